@@ -1,13 +1,22 @@
 import os
-from dag_loader import DagLoader, DagSampler
+import sys
+import hashlib
+from dag_loader import DagLoader, DagSampler, node_costs
 from dct_policy import dct_policy
 from baseline_policies import random_policy, max_degree_policy, opt_single_policy, coloring_policy, greedy_minmax_policy, greedy_entropy_policy
 import numpy as np
+import pandas as pd
+import inspect
 from tqdm import tqdm
-from p_tqdm import p_map
-from time import time
+from time import time, sleep
 from multiprocessing import cpu_count
+import heapq
 import random
+from causaldag import PDAG
+from dag_cache import DagCache
+from dag_corpus import DagCorpus, dag_arcs, dag_from_arcs
+from results_store import ResultsStore
+from verify import atomic_verification_fast, weighted_atomic_verification
 
 from separator_policy import *
 
@@ -22,10 +31,208 @@ ALG_DICT = {
     'separator_k1': (separator_policy, {'k': 1}),
     'separator_k2': (separator_policy, {'k': 2}),
     'separator_k3': (separator_policy, {'k': 3}),
-    'separator_k5': (separator_policy, {'k': 5})
+    'separator_k5': (separator_policy, {'k': 5}),
+    'separator_batched_k1': (separator_policy, {'k': 1, 'batched': True}),
+    'separator_batched_k2': (separator_policy, {'k': 2, 'batched': True}),
+    'separator_batched_k3': (separator_policy, {'k': 3, 'batched': True}),
+    'separator_batched_k5': (separator_policy, {'k': 5, 'batched': True})
 }
 
 
+'''
+Given a (possibly lazy) iterable of (estimated cost, function, task) items, apply function(*task) to every task on a pool of long-lived worker processes and yield (index of item, result) pairs in completion order.
+Items are pulled from the iterable only while fewer than window of them are queued or running, and whenever a worker is free it gets the costliest queued task: the largest graphs start first, and the small ones fill the remaining cores at the end instead of straggling.
+Since the iterable is advanced between submissions, DAGs that are being generated are evaluated as soon as they are written, while the workers keep busy with the earlier ones. Items that are all known upfront should come largest first, as the ordering only holds within the window.
+The pool is not closed afterwards: pathos keeps it alive, so consecutive calls (e.g. for each policy and setting of an experiment) reuse the same workers.
+'''
+def scheduled_imap(items, num_cpus=None, window=None, poll_interval=.01):
+    from pathos.multiprocessing import ProcessPool
+
+    num_cpus = cpu_count() if num_cpus is None else num_cpus
+    window = 2 * num_cpus if window is None else window
+    pool = ProcessPool(num_cpus)
+    items = enumerate(items)
+    queued = []
+    running = dict()
+    exhausted = False
+    while True:
+        # Pull one item at a time, so that free workers start right away instead of waiting for the window to fill
+        can_pull = not exhausted and len(queued) + len(running) < window
+        if can_pull:
+            try:
+                i, (cost, function, task) = next(items)
+                heapq.heappush(queued, (-cost, i, function, task))
+            except StopIteration:
+                exhausted = True
+        while queued and len(running) < num_cpus:
+            _, i, function, task = heapq.heappop(queued)
+            running[i] = pool.apipe(function, *task)
+        if exhausted and not running:
+            return
+
+        finished = [i for i, result in running.items() if result.ready()]
+        if not finished and not can_pull:
+            sleep(poll_interval)
+        for i in finished:
+            yield i, running.pop(i).get()
+
+
+# Per-process state of the workers: every corpus is memory-mapped once per process, and the cache handle is kept so that its size is only scanned once
+_worker_corpora = dict()
+_worker_cache = None
+_policy_fingerprints = dict()
+
+def _get_worker_cache():
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = DagCache()
+    return _worker_cache
+
+'''
+Fingerprint of the code and parameters of policy alg: a hash of its parameters, of the source of the module that defines it and of the source of the PDAG class it runs on.
+Cached outcomes are keyed by it, so any edit to a policy (or to PDAG) invalidates its old outcomes instead of silently reporting them.
+'''
+def policy_fingerprint(alg):
+    if alg not in _policy_fingerprints:
+        alg_function, params = ALG_DICT[alg]
+        h = hashlib.sha1(repr(sorted(params.items())).encode())
+        for filename in sorted({inspect.getsourcefile(sys.modules[alg_function.__module__]), inspect.getsourcefile(PDAG)}):
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        _policy_fingerprints[alg] = h.hexdigest()[:16]
+    return _policy_fingerprints[alg]
+
+'''
+Yield the scheduled_imap items of the DAGs of a setting that miss some policy, where missing(ix) lists the policies that DAG ix misses.
+DAGs that have to be generated first are yielded as soon as they are written, with their arcs shipped in the task. DAGs that are already on disk are yielded largest first and read by the workers straight from the corpus.
+'''
+def setting_tasks(dag_loader, missing, overwrite=False, use_cache=True):
+    if overwrite or not dag_loader.has_dags():
+        random.seed(9859787)
+        for ix, dag in enumerate(dag_loader.iter_dags(overwrite=overwrite)):
+            algs = missing(ix)
+            if algs:
+                nnodes, arcs = dag_arcs(dag)
+                task = (algs, nnodes, arcs, ix, True, use_cache, dag_loader.cost_sigma, overwrite)
+                yield (len(algs) + 1) * (nnodes + len(arcs)), run_algs_on_arcs, task
+    else:
+        corpus = dag_loader.get_corpus()
+        items = []
+        for ix in range(len(corpus)):
+            algs = missing(ix)
+            if algs:
+                task = (algs, corpus.filename, ix, True, use_cache, dag_loader.cost_sigma, overwrite)
+                items.append(((len(algs) + 1) * (corpus.nnodes(ix) + corpus.num_arcs(ix)), run_algs_on_corpus, task))
+        yield from sorted(items, key=lambda item: -item[0])
+
+'''
+Build the essential graph of dag with PDAG.from_dag and return it with the time it took
+'''
+def timed_cpdag(dag):
+    start = time()
+    cpdag = PDAG.from_dag(dag)
+    return cpdag, time() - start
+
+def _accepts_cpdag(alg):
+    return 'cpdag' in inspect.signature(ALG_DICT[alg][0]).parameters
+
+'''
+Run every policy in algs on a DAG given by its number of nodes and its (num_arcs, 2) array of arcs, as yielded by setting_tasks for DAGs that are not in a corpus yet.
+'''
+def run_algs_on_arcs(algs, nnodes, arcs, ix, verify=True, use_cache=True, cost_sigma=None, refresh=False):
+    costs = None if cost_sigma is None else node_costs(cost_sigma, ix, nnodes)
+    return run_algs_on_dag(algs, dag_from_arcs(nnodes, arcs), ix, verify=verify, use_cache=use_cache, costs=costs, refresh=refresh)
+
+'''
+Run every policy in algs on DAG ix of a corpus file. Only the file name and index are sent to the worker, which reads the arcs straight from the shared memory map.
+With cost_sigma, the per-node intervention costs of the DAG are regenerated by node_costs.
+'''
+def run_algs_on_corpus(algs, corpus_filename, ix, verify=True, use_cache=True, cost_sigma=None, refresh=False):
+    if corpus_filename not in _worker_corpora:
+        _worker_corpora[corpus_filename] = DagCorpus(corpus_filename)
+    dag = _worker_corpora[corpus_filename][ix]
+    costs = None if cost_sigma is None else node_costs(cost_sigma, ix, dag.nnodes)
+    return run_algs_on_dag(algs, dag, ix, verify=verify, use_cache=use_cache, costs=costs, refresh=refresh)
+
+'''
+Run every policy in algs on dag and, if verify, compute its verification number nu_1, so that the DAG is read and its essential graph is built only once.
+If some policy takes the essential graph as input, it is built (rather than read from the cache) and its build time is charged to those policies, as the other policies build it themselves.
+With per-node intervention costs (costs[v] for every node v), also compute the cost nu1_cost of a minimum-cost verifying set, which lower-bounds the cost of every atomic policy.
+Return one ResultsStore row (without the setting columns) per policy.
+'''
+def run_algs_on_dag(algs, dag, ix, verify=True, use_cache=True, costs=None, refresh=False):
+    cache = _get_worker_cache()
+    cpdag_time = None
+    if any(_accepts_cpdag(alg) for alg in algs):
+        cpdag, cpdag_time = timed_cpdag(dag)
+    else:
+        cpdag = cache.cpdag(dag) if use_cache else PDAG.from_dag(dag)
+    nu1 = None
+    nu1_cost = None
+    if verify:
+        nu1 = len(cache.atomic_verification(dag) if use_cache else atomic_verification_fast(dag.to_nx()))
+        if costs is not None:
+            nu1_cost = float(sum(costs[v] for v in weighted_atomic_verification(dag.to_nx(), costs)))
+    return [
+        dict(dag_ix=ix, alg=alg, k=ALG_DICT[alg][1].get('k'), nu1=nu1, nu1_cost=nu1_cost, **run_alg(alg, dag, ix, use_cache=use_cache, cpdag=cpdag, costs=costs, refresh=refresh, cpdag_time=cpdag_time))
+        for alg in algs
+    ]
+
+'''
+Run policy alg on dag and check that its interventions fully orient the essential graph.
+Return a dict with the number of interventions, the time taken, for policies that report them, the number of rounds and of Meek-oriented arcs, and with per-node costs, the total cost of the interventions (the sum of the costs of their nodes).
+Policies that accept costs are given them, and policies that accept cpdag are given the essential graph shared with the validation instead of building their own (they must not modify it, as separator_policy works on a copy).
+So that all policies are timed the same way, the time cpdag_time it took to build that essential graph (see timed_cpdag) is added to their time; if cpdag is not given, it is built and timed here. Outcomes are keyed by the content of the DAG (and costs) and by policy_fingerprint, so they are shared across experiments and reruns of the same code.
+An outcome served from the cache has no time (None), since its running time was not measured by this run. With refresh, the policy is always run and its outcome overwrites the cached one.
+'''
+def run_alg(alg, dag, ix, use_cache=True, cpdag=None, costs=None, refresh=False, cpdag_time=None):
+    cache = _get_worker_cache()
+    cache_key = f'{alg},code={policy_fingerprint(alg)}'
+    if costs is not None:
+        cache_key += f',costs={hashlib.sha1(np.asarray(costs, dtype=np.float64).tobytes()).hexdigest()[:16]}'
+    if use_cache and not refresh:
+        outcome = cache.policy_outcome(dag, cache_key)
+        if outcome is not None:
+            return dict(outcome, time=None)
+
+    alg_function, params = ALG_DICT[alg]
+    alg_parameters = inspect.signature(alg_function).parameters
+    if 'cpdag' in alg_parameters and (cpdag is None or cpdag_time is None):
+        cpdag, cpdag_time = timed_cpdag(dag)
+    elif cpdag is None:
+        cpdag = cache.cpdag(dag) if use_cache else PDAG.from_dag(dag)
+
+    start = time()
+    #intervened_nodes = ALG_DICT[alg](dag)
+    stats = dict()
+    if 'stats' in alg_parameters:
+        params = dict(params, stats=stats)
+    if costs is not None and 'costs' in alg_parameters:
+        params = dict(params, costs=costs)
+    if 'cpdag' in alg_parameters:
+        params = dict(params, cpdag=cpdag)
+    intervened_nodes = alg_function(dag=dag, **params)
+    time_taken = time() - start
+    if 'cpdag' in alg_parameters:
+        time_taken += cpdag_time
+
+    # Always validate
+    #cpdag = dag.interventional_cpdag([{node} for node in intervened_nodes], cpdag=dag.cpdag())
+    icpdag = cpdag.batch_interventional_cpdag(dag, [{intervention} if type(intervention) is not frozenset else intervention for intervention in intervened_nodes])
+    if icpdag.num_edges > 0:
+        print(f"**************** BROKEN")
+        print(f"ix={ix}, alg={alg}, num intervened = {len(intervened_nodes)}, num edges={icpdag.num_edges}")
+        raise RuntimeError
+    # write_list(intervened_nodes, os.path.join(self.alg_folder, f'nodes{ix}.txt'))
+    cost = None
+    if costs is not None:
+        cost = float(sum(costs[v] for intervention in intervened_nodes for v in (intervention if type(intervention) is frozenset else {intervention})))
+    outcome = dict(interventions=len(intervened_nodes), time=time_taken, rounds=stats.get('rounds'), meek_arcs=stats.get('meek_arcs'), cost=cost)
+    if use_cache:
+        cache.put_policy_outcome(dag, cache_key, outcome)
+    return outcome
+
+
 class AlgRunner:
     def __init__(self, alg: str, dag_loader: DagLoader):
         self.alg = alg
@@ -35,56 +242,62 @@ class AlgRunner:
     def alg_folder(self):
         return os.path.join(self.dag_loader.dag_folder, 'results', f'alg={self.alg}')
 
-    def get_alg_results(self, overwrite=False, validate=True, multithread=True):
+    def completed_dags(self, store=None) -> set:
+        """Return the indices of the DAGs that already have a result for this policy in the store
+        """
+        store = ResultsStore() if store is None else store
+        return set(store.read(columns=['dag_ix'], alg=self.alg, **self.dag_loader.setting)['dag_ix'])
+
+    def has_results(self, store=None):
+        return len(self.completed_dags(store)) == self.dag_loader.num_dags
+
+    def save_results(self, rows, store=None):
+        store = ResultsStore() if store is None else store
+        store.append([dict(row, **self.dag_loader.setting) for row in rows])
+
+    def load_results(self, store=None) -> pd.DataFrame:
+        store = ResultsStore() if store is None else store
+        return store.read(alg=self.alg, **self.dag_loader.setting)
+
+    def get_alg_results(self, overwrite=False, validate=True, multithread=True, use_cache=True):
+        """
+        Run the policy on every DAG that has no result yet and return the (interventions, times) arrays over all DAGs.
+        The rows of every DAG are appended to the store as soon as it is done, so an interrupted run resumes where it
+        stopped (as does an interrupted generation of the DAGs). With overwrite, the DAGs are regenerated, all results
+        of the setting are discarded first and every policy is rerun rather than read from the cache.
+        """
         random.seed(9859787)
-        result_filename = os.path.join(self.alg_folder, f'num_nodes_list.npy')
-        time_result_filename = os.path.join(self.alg_folder, f'times_list.npy')
         print(self.alg_folder)
-        if overwrite or not os.path.exists(self.alg_folder):
-            dags = self.dag_loader.get_dags(overwrite=overwrite)
-            os.makedirs(self.alg_folder, exist_ok=True)
-
-            def run_alg(tup):
-                ix, dag = tup
-
-                start = time()
-                #intervened_nodes = ALG_DICT[self.alg](dag)
-                alg, params = ALG_DICT[self.alg]
-                params['dag'] = dag
-                intervened_nodes = alg(**params)
-                time_taken = time() - start
-
-                validate = True # Always validate
-                if validate:
-                    #cpdag = dag.interventional_cpdag([{node} for node in intervened_nodes], cpdag=dag.cpdag())
-                    cpdag = dag.interventional_cpdag([{intervention} if type(intervention) is not frozenset else intervention for intervention in intervened_nodes], cpdag=dag.cpdag())
-                    if cpdag.num_edges > 0:
-                        print(f"**************** BROKEN")
-                        print(f"ix={ix}, alg={self.alg}, num intervened = {len(intervened_nodes)}, num edges={cpdag.num_edges}")
-                        raise RuntimeError
-                # write_list(intervened_nodes, os.path.join(self.alg_folder, f'nodes{ix}.txt'))
-                return len(intervened_nodes), time_taken
+        store = ResultsStore()
+        if overwrite:
+            store.delete(**self.dag_loader.setting)
+        done = self.completed_dags(store)
 
+        if len(done) < self.dag_loader.num_dags:
             if multithread:
-                print(f'[AlgRunner.get_alg_results] Running {self.alg} on {cpu_count()-1} cores')
-                num_nodes_list, times_list = zip(*p_map(run_alg, list(enumerate(dags))))
+                # DAGs are fed to the workers as soon as they are generated (or straight from the corpus), largest graphs first
+                items = setting_tasks(self.dag_loader, lambda ix: [] if ix in done else [self.alg], overwrite=overwrite, use_cache=use_cache)
+                print(f'[AlgRunner.get_alg_results] Running {self.alg} on {self.dag_loader.num_dags - len(done)} DAGs on {cpu_count()} cores')
+                for _, dag_rows in tqdm(scheduled_imap(items), total=self.dag_loader.num_dags - len(done)):
+                    self.save_results(dag_rows, store)
             else:
+                # DAGs are sampled or loaded lazily, and fed to the policy as soon as they are available
+                dags = self.dag_loader.iter_dags(overwrite=overwrite)
                 print(f'[AlgRunner.get_alg_results] Running {self.alg} on 1 core')
                 #num_nodes_list, times_list = zip(*list(tqdm((run_alg(dag) for dag in dags), total=len(dags))))
-                num_nodes_list, times_list = zip(*list(tqdm((run_alg((i,dags[i])) for i in range(len(dags))), total=len(dags))))
+                for ix, dag in tqdm(enumerate(dags), total=self.dag_loader.num_dags):
+                    if ix not in done:
+                        self.save_results(run_algs_on_dag([self.alg], dag, ix, use_cache=use_cache, costs=self.dag_loader.costs(ix, dag.nnodes), refresh=overwrite), store)
+            store.compact()
 
-            np.save(result_filename, np.array(num_nodes_list))
-            np.save(time_result_filename, np.array(times_list))
-            return np.array(num_nodes_list), np.array(times_list)
-        else:
-            return np.load(result_filename), np.load(time_result_filename)
+        results = self.load_results(store)
+        return results['interventions'].to_numpy(), results['time'].to_numpy()
 
     def specific_dag(self, ix, verbose=False):
         dag = self.dag_loader.get_dags()[ix]
         intervened_nodes = ALG_DICT[self.alg](dag, verbose=verbose)
         print(intervened_nodes)
-        cpdag = dag.interventional_cpdag([{node} for node in intervened_nodes], cpdag=dag.cpdag())
-        cpdag.to_complete_pdag()
+        cpdag = PDAG.from_dag(dag).batch_interventional_cpdag(dag, [{node} for node in intervened_nodes])
         print(cpdag.edges)
 
 
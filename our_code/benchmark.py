@@ -0,0 +1,168 @@
+"""
+Benchmarks for the PDAG core operations, verification and separator_policy on fixed seeded graphs of every DagSampler family
+
+Usage:
+    python3 benchmark.py --save NAME                  run all benchmarks and store the timings as baseline NAME
+    python3 benchmark.py --compare NAME               run all benchmarks and report regressions against baseline NAME
+    python3 benchmark.py --samplers SHANMUGAM --nnodes 100 500 --filter separator
+
+Graphs are sampled once per (sampler, nnodes, seed) and kept as corpus files, so that runs on different versions of
+the code time exactly the same inputs.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import subprocess
+import numpy as np
+from time import perf_counter, strftime
+from causaldag import PDAG
+from causaldag.classes.pdag import AMAT_MAX_NODES
+from config import BENCHMARK_FOLDER
+
+from dag_loader import DagLoader, DagSampler
+from dag_corpus import DagCorpus, write_dag_corpus
+from separator_policy import separator_policy, undirected_components, compute_clique_graph_separator
+from verify import atomic_verification, atomic_verification_fast
+
+NNODES_LIST = [100, 500, 1000, 2000, 5000]
+K_LIST = [1, 2, 3, 5]
+
+# Sampler parameters, as a function of the number of nodes; densities are scaled down so that large graphs stay sparse
+SAMPLER_PARAMS = {
+    DagSampler.CHORDAL2: lambda nnodes: dict(density=min(.1, 5 / nnodes)),
+    DagSampler.TREE_PLUS: lambda nnodes: dict(e_min=2, e_max=5),
+    DagSampler.HAIRBALL_PLUS: lambda nnodes: dict(degree=4, e_min=2, e_max=5),
+    DagSampler.TREE_OF_CLIQUES: lambda nnodes: dict(degree=3, min_clique_size=3, max_clique_size=5, nnodes=nnodes),
+    DagSampler.ERDOS: lambda nnodes: dict(density=min(.1, 5 / nnodes)),
+    DagSampler.SHANMUGAM: lambda nnodes: dict(density=min(.1, 5 / nnodes)),
+}
+
+
+'''
+Return the benchmark DAG of a sampler family on nnodes nodes, sampling it with a fixed seed the first time
+'''
+def benchmark_dag(sampler, nnodes, seed):
+    filename = os.path.join(BENCHMARK_FOLDER, 'graphs', f'sampler={sampler.name},nnodes={nnodes},seed={seed}.corpus')
+    if not os.path.exists(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        random.seed(seed)
+        np.random.seed(seed)
+        dl = DagLoader(nnodes, 1, sampler, SAMPLER_PARAMS[sampler](nnodes), comparable_edges=True)
+        write_dag_corpus(filename, [dl._sample_dag()])
+    return DagCorpus(filename)[0]
+
+'''
+Return the benchmark cases of one DAG as a list of (name, setup, run), where run(setup()) is the timed operation.
+Interventions are on a fixed random 1% of the nodes, so that the Meek rules have something to propagate.
+'''
+def benchmark_cases(dag, seed):
+    rng = random.Random(seed)
+    nodes = sorted(dag.nodes)
+    intervened_nodes = set(rng.sample(nodes, max(1, len(nodes) // 100)))
+    cut_arcs = {(i, j) for i, j in dag.arcs if len({i, j} & intervened_nodes) == 1}
+    cpdag = PDAG.from_dag(dag)
+    icpdag = cpdag.interventional_cpdag(dag, intervened_nodes)
+    cc_nodes, adj_list = max(undirected_components(cpdag), key=lambda component: len(component[0]))
+    G = dag.to_nx()
+
+    cases = [
+        ('cpdag', lambda: None, lambda _: dag.cpdag()),
+        ('cpdag_from_dag', lambda: None, lambda _: PDAG.from_dag(dag)),
+        ('to_complete_pdag', lambda: PDAG(nodes, cut_arcs, dag.arcs - cut_arcs), lambda p: p.to_complete_pdag()),
+        ('interventional_cpdag', lambda: None, lambda _: cpdag.interventional_cpdag(dag, intervened_nodes)),
+        ('chain_components', lambda: None, lambda _: icpdag.chain_components()),
+        ('compute_clique_graph_separator', lambda: None, lambda _: compute_clique_graph_separator(adj_list, list(range(len(cc_nodes))))),
+        ('atomic_verification', lambda: None, lambda _: atomic_verification(G)),
+        ('atomic_verification_fast', lambda: None, lambda _: atomic_verification_fast(G)),
+    ]
+    if len(nodes) <= AMAT_MAX_NODES:
+        # Larger graphs are routed to the set-based propagation, so the dense engine is only timed where it runs
+        cases.append(('to_complete_pdag_amat', lambda: PDAG(nodes, cut_arcs, dag.arcs - cut_arcs), lambda p: p.to_complete_pdag_amat()))
+    for k in K_LIST:
+        cases.append((f'separator_policy_k{k}', lambda: None, lambda _, k=k: separator_policy(dag, k)))
+    return cases
+
+'''
+Time run(setup()) repeat times, excluding setup, and return summary statistics in seconds
+'''
+def time_case(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        arg = setup()
+        start = perf_counter()
+        run(arg)
+        times.append(perf_counter() - start)
+    return dict(min=min(times), median=float(np.median(times)), mean=float(np.mean(times)), repeat=repeat)
+
+def run_benchmarks(samplers, nnodes_list, repeat=3, seed=0, name_filter=None):
+    results = dict()
+    for sampler in samplers:
+        for nnodes in nnodes_list:
+            dag = benchmark_dag(sampler, nnodes, seed)
+            for name, setup, run in benchmark_cases(dag, seed):
+                if name_filter is not None and name_filter not in name:
+                    continue
+                case_id = f'{name}/sampler={sampler.name}/nnodes={nnodes}'
+                results[case_id] = dict(time_case(setup, run, repeat), nnodes=dag.nnodes, num_arcs=dag.num_arcs)
+                print(f"{case_id:<70} {results[case_id]['median']:>10.4f}s")
+    return results
+
+def _baseline_filename(name):
+    return os.path.join(BENCHMARK_FOLDER, 'baselines', f'{name}.json')
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_baseline(name, results):
+    filename = _baseline_filename(name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(dict(commit=_git_commit(), python=sys.version, date=strftime('%Y-%m-%d %H:%M:%S'), results=results), f, indent=1)
+    print(f'Saved baseline {filename}')
+
+'''
+Compare the median timings of results against a stored baseline and return the ids of the cases that got slower by more than a factor 1 + threshold
+'''
+def compare_to_baseline(name, results, threshold=.2):
+    with open(_baseline_filename(name)) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    print(f"{'case':<70} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for case_id in sorted(results.keys() & baseline.keys()):
+        ratio = results[case_id]['median'] / max(baseline[case_id]['median'], 1e-9)
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(case_id)
+            flag = ' REGRESSION'
+        elif ratio < 1 / (1 + threshold):
+            flag = ' faster'
+        print(f"{case_id:<70} {baseline[case_id]['median']:>10.4f} {results[case_id]['median']:>10.4f} {ratio:>7.2f}{flag}")
+    print(f'{len(regressions)} regressions out of {len(results.keys() & baseline.keys())} cases compared')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samplers', nargs='+', default=[sampler.name for sampler in SAMPLER_PARAMS])
+    parser.add_argument('--nnodes', nargs='+', type=int, default=NNODES_LIST)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--filter', default=None, help='only run cases whose name contains this string')
+    parser.add_argument('--save', default=None, help='store the timings as the baseline with this name')
+    parser.add_argument('--compare', default=None, help='compare the timings against the baseline with this name')
+    parser.add_argument('--threshold', type=float, default=.2, help='relative slowdown of the median reported as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks([DagSampler[name] for name in args.samplers], args.nnodes, repeat=args.repeat, seed=args.seed, name_filter=args.filter)
+    if args.save is not None:
+        save_baseline(args.save, results)
+    if args.compare is not None:
+        regressions = compare_to_baseline(args.compare, results, threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,262 @@
+"""
+Compact PDAG backend where nodes are relabelled to 0..n-1 and every relation is stored as one integer bitmask per node
+"""
+
+from causaldag import PDAG
+
+
+'''
+Iterate over the indices of the set bits of the bitmask m, from lowest to highest
+'''
+def iter_bits(m):
+    while m:
+        low = m & -m
+        yield low.bit_length() - 1
+        m ^= low
+
+
+class BitsetPDAG:
+    """
+    Drop-in alternative to PDAG for the operations used by the search policies.
+
+    Bit i of self._parents[j] is set iff i->j, bit j of self._children[i] is set iff i->j, and bit j of
+    self._undirected[i] is set iff i--j. Adjacency tests and the configuration (d) scan of the Meek rules then become
+    bitwise ANDs over Python integers instead of tuple/frozenset hashing.
+    """
+    def __init__(self, nodes=set(), arcs=set(), edges=set()):
+        try:
+            self._node_list = sorted(set(nodes) | {v for arc in arcs for v in arc} | {v for edge in edges for v in edge})
+        except TypeError:
+            self._node_list = list(set(nodes) | {v for arc in arcs for v in arc} | {v for edge in edges for v in edge})
+        self._node2ix = {node: ix for ix, node in enumerate(self._node_list)}
+        n = len(self._node_list)
+        self._parents = [0] * n
+        self._children = [0] * n
+        self._undirected = [0] * n
+        self._num_arcs = 0
+        self._num_edges = 0
+        for i, j in arcs:
+            self._add_arc(self._node2ix[i], self._node2ix[j])
+        for i, j in edges:
+            self._add_edge(self._node2ix[i], self._node2ix[j])
+
+    @classmethod
+    def from_pdag(cls, pdag: PDAG):
+        return BitsetPDAG(pdag._nodes, pdag._arcs, pdag._edges)
+
+    def to_pdag(self) -> PDAG:
+        return PDAG(self.nodes, self.arcs, self.edges)
+
+    def copy(self):
+        """Return a copy of the graph
+        """
+        other = BitsetPDAG.__new__(BitsetPDAG)
+        other._node_list = self._node_list
+        other._node2ix = self._node2ix
+        other._parents = list(self._parents)
+        other._children = list(self._children)
+        other._undirected = list(self._undirected)
+        other._num_arcs = self._num_arcs
+        other._num_edges = self._num_edges
+        return other
+
+    # === PROPERTIES
+    @property
+    def nodes(self):
+        return set(self._node_list)
+
+    @property
+    def nnodes(self):
+        return len(self._node_list)
+
+    @property
+    def num_arcs(self):
+        return self._num_arcs
+
+    @property
+    def num_edges(self):
+        return self._num_edges
+
+    @property
+    def arcs(self):
+        return {
+            (self._node_list[i], self._node_list[j])
+            for i, children in enumerate(self._children) for j in iter_bits(children)
+        }
+
+    @property
+    def edges(self):
+        return {
+            frozenset({self._node_list[i], self._node_list[j]})
+            for i, nbrs in enumerate(self._undirected) for j in iter_bits(nbrs >> (i + 1) << (i + 1))
+        }
+
+    # === PROPERTIES W/ ARGUMENTS
+    def _adjacency(self, i):
+        return self._parents[i] | self._children[i] | self._undirected[i]
+
+    def parents_of(self, node):
+        return {self._node_list[i] for i in iter_bits(self._parents[self._node2ix[node]])}
+
+    def children_of(self, node):
+        return {self._node_list[i] for i in iter_bits(self._children[self._node2ix[node]])}
+
+    def undirected_neighbors_of(self, node):
+        return {self._node_list[i] for i in iter_bits(self._undirected[self._node2ix[node]])}
+
+    def undirected_degree_of(self, node):
+        return bin(self._undirected[self._node2ix[node]]).count('1')
+
+    def has_edge(self, i, j):
+        """Return True if the graph contains the edge i--j
+        """
+        return (self._undirected[self._node2ix[i]] >> self._node2ix[j]) & 1 == 1
+
+    def has_arc(self, i, j):
+        """Return True if the graph contains the arc i->j"""
+        return (self._children[self._node2ix[i]] >> self._node2ix[j]) & 1 == 1
+
+    def has_edge_or_arc(self, i, j):
+        """Return True if the graph contains the edge i--j or an arc i->j or i<-j
+        """
+        return (self._adjacency(self._node2ix[i]) >> self._node2ix[j]) & 1 == 1
+
+    def chain_components(self):
+        """Return the chain components of this graph, as BitsetPDAGs over the original node labels.
+        """
+        components = []
+        unvisited = (1 << self.nnodes) - 1
+        while unvisited:
+            low = unvisited & -unvisited
+            component = low
+            frontier = low
+            while frontier:
+                reached = 0
+                for i in iter_bits(frontier):
+                    reached |= self._undirected[i]
+                frontier = reached & ~component
+                component |= frontier
+            unvisited &= ~component
+            if component != low:
+                components.append(self.induced_subgraph(component))
+        return components
+
+    def induced_subgraph(self, mask):
+        """Return the subgraph induced by the nodes whose bits are set in mask
+        """
+        nodes = [self._node_list[i] for i in iter_bits(mask)]
+        arcs = {
+            (self._node_list[i], self._node_list[j])
+            for i in iter_bits(mask) for j in iter_bits(self._children[i] & mask)
+        }
+        edges = {
+            (self._node_list[i], self._node_list[j])
+            for i in iter_bits(mask) for j in iter_bits(self._undirected[i] & mask) if i < j
+        }
+        return BitsetPDAG(nodes, arcs, edges)
+
+    # === MUTATORS
+    def _add_arc(self, i, j):
+        self._children[i] |= 1 << j
+        self._parents[j] |= 1 << i
+        self._num_arcs += 1
+
+    def _add_edge(self, i, j):
+        if not (self._undirected[i] >> j) & 1:
+            self._undirected[i] |= 1 << j
+            self._undirected[j] |= 1 << i
+            self._num_edges += 1
+
+    def _replace_edge_with_arc(self, i, j):
+        self._undirected[i] &= ~(1 << j)
+        self._undirected[j] &= ~(1 << i)
+        self._num_edges -= 1
+        self._add_arc(i, j)
+
+    def _meek_rule(self, i, j):
+        """Return the configuration ('a', 'b' or 'd', as in PDAG.to_complete_pdag) that forces the edge i--j to be
+        oriented as i->j, or None if there is none.
+        """
+        # check configuration (a) -- causal chain
+        if self._parents[i] & ~self._adjacency(j):
+            return 'a'
+
+        # check configuration (b) -- acyclicity
+        if self._children[i] & self._parents[j]:
+            return 'b'
+
+        # check configuration (d)
+        candidates = self._parents[j] & self._undirected[i]
+        for k1 in iter_bits(candidates):
+            if candidates & ~self._adjacency(k1) & ~(1 << k1):
+                return 'd'
+        return None
+
+    def _propagate(self, worklist):
+        oriented = []
+        while worklist:
+            node = worklist.pop()
+            for nbr in iter_bits(self._undirected[node]):
+                if not (self._undirected[node] >> nbr) & 1:
+                    continue
+                for i, j in ((node, nbr), (nbr, node)):
+                    if self._meek_rule(i, j) is not None:
+                        self._replace_edge_with_arc(i, j)
+                        oriented.append((i, j))
+                        worklist.append(node)
+                        worklist.append(nbr)
+                        break
+        return oriented
+
+    def to_complete_pdag(self):
+        """
+        Replace with arcs those edges whose orientations can be determined by Meek rules.
+        """
+        self._propagate(list(range(self.nnodes)))
+
+    def _orient_cut_arcs(self, dag, intervened_nodes, oriented, worklist):
+        intervened_nodes = set(intervened_nodes)
+        for node in intervened_nodes:
+            for u, v in dag.incident_arcs(node):
+                if len({u, v} & intervened_nodes) == 1:
+                    i, j = self._node2ix[u], self._node2ix[v]
+                    if (self._undirected[i] >> j) & 1:
+                        self._replace_edge_with_arc(i, j)
+                        oriented.append((i, j))
+                        worklist.append(i)
+                        worklist.append(j)
+
+    def intervene(self, dag, intervened_nodes):
+        """Orient the edges cut by intervening on intervened_nodes of dag and propagate the Meek rules, in place.
+
+        This graph is assumed to be closed under the Meek rules. Return the set of newly oriented arcs.
+        """
+        oriented = []
+        worklist = []
+        self._orient_cut_arcs(dag, intervened_nodes, oriented, worklist)
+        oriented += self._propagate(worklist)
+        return {(self._node_list[i], self._node_list[j]) for i, j in oriented}
+
+    def intervene_batch(self, dag, interventions):
+        """Same as intervene on each intervention set in interventions in turn, with one propagation of the Meek rules
+        """
+        oriented = []
+        worklist = []
+        for intervened_nodes in interventions:
+            self._orient_cut_arcs(dag, intervened_nodes, oriented, worklist)
+        oriented += self._propagate(worklist)
+        return {(self._node_list[i], self._node_list[j]) for i, j in oriented}
+
+    def interventional_cpdag(self, dag, intervened_nodes):
+        """Return the interventional essential graph obtained by intervening on intervened_nodes of dag.
+        """
+        p = self.copy()
+        p.intervene(dag, intervened_nodes)
+        return p
+
+    def batch_interventional_cpdag(self, dag, interventions):
+        """Return the interventional essential graph obtained by all the intervention sets in interventions on dag.
+        """
+        p = self.copy()
+        p.intervene_batch(dag, interventions)
+        return p
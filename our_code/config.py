@@ -4,6 +4,10 @@ import seaborn as sns
 BASE_FOLDER = os.path.dirname(__file__)
 DATA_FOLDER = os.path.join(BASE_FOLDER, 'data')
 FIGURE_FOLDER = os.path.join(BASE_FOLDER, 'figures')
+CACHE_FOLDER = os.path.join(DATA_FOLDER, 'cache')
+CACHE_MAX_BYTES = 2 * 1024**3
+RESULTS_FOLDER = os.path.join(DATA_FOLDER, 'results')
+BENCHMARK_FOLDER = os.path.join(BASE_FOLDER, 'benchmarks')
 
 policies = [
     'dct',
@@ -15,9 +19,14 @@ policies = [
     'separator_k1',
     'separator_k2',
     'separator_k3',
-    'separator_k5'
+    'separator_k5',
+    'separator_batched_k1',
+    'separator_batched_k2',
+    'separator_batched_k3',
+    'separator_batched_k5'
 ]
-POLICY2COLOR = dict(zip(policies, sns.color_palette('bright')))
+# 'tab20' has 20 distinct colours, enough for every policy (smaller palettes such as 'bright' cycle)
+POLICY2COLOR = dict(zip(policies, sns.color_palette('tab20', n_colors=len(policies))))
 POLICY2LABEL = {
     'dct': 'DCT',
     'random': 'Random',
@@ -28,5 +37,9 @@ POLICY2LABEL = {
     'separator_k1': 'Ours (k=1)',
     'separator_k2': 'Ours (k=2)',
     'separator_k3': 'Ours (k=3)',
-    'separator_k5': 'Ours (k=5)'
+    'separator_k5': 'Ours (k=5)',
+    'separator_batched_k1': 'Ours batched (k=1)',
+    'separator_batched_k2': 'Ours batched (k=2)',
+    'separator_batched_k3': 'Ours batched (k=3)',
+    'separator_batched_k5': 'Ours batched (k=5)'
 }
@@ -0,0 +1,170 @@
+"""
+Persistent content-addressed cache for per-DAG computations (essential graphs, covered edges, verification sets and
+policy outcomes), keyed by a canonical hash of the DAG's adjacency matrix
+"""
+
+import os
+import hashlib
+import shutil
+import numpy as np
+from causaldag import DAG, PDAG
+from config import CACHE_FOLDER, CACHE_MAX_BYTES
+
+from verify import compute_covered_edges_fast, atomic_verification_fast
+
+
+'''
+Canonical hash of a DAG, given either as a causaldag DAG or as an adjacency matrix (amat[i,j] != 0 iff i->j).
+Nodes are indexed by their sorted order, so a DAG and its to_amat() matrix have the same hash.
+'''
+def dag_hash(dag) -> str:
+    if isinstance(dag, np.ndarray):
+        nnodes = dag.shape[0]
+        arcs = np.argwhere(dag != 0)
+    else:
+        node2ix = {node: i for i, node in enumerate(sorted(dag.nodes))}
+        nnodes = len(node2ix)
+        arcs = np.array(sorted((node2ix[i], node2ix[j]) for i, j in dag.arcs), dtype=np.int64).reshape(-1, 2)
+    h = hashlib.sha1(np.int64(nnodes).tobytes())
+    h.update(arcs.astype(np.int64).tobytes())
+    return h.hexdigest()
+
+
+class DagCache:
+    """
+    On-disk cache with one folder per DAG hash, holding one .npy file per cached quantity.
+
+    Writes are atomic (write to a temporary file, then rename), so several worker processes can share one cache.
+    Whenever the cache grows beyond max_bytes, the least recently used DAG folders are evicted; reading an entry
+    refreshes its folder's modification time.
+    """
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._size = None
+
+    def _entry_filename(self, key, name):
+        return os.path.join(self.folder, key[:2], key, f'{name}.npy')
+
+    def get(self, key, name):
+        filename = self._entry_filename(key, name)
+        try:
+            value = np.load(filename)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(os.path.dirname(filename))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, name, value):
+        filename = self._entry_filename(key, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp.npy'
+        np.save(tmp_filename, np.asarray(value))
+        os.replace(tmp_filename, filename)
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += os.path.getsize(filename)
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def get_or_compute(self, key, name, compute):
+        value = self.get(key, name)
+        if value is None:
+            value = np.asarray(compute())
+            self.put(key, name, value)
+        return value
+
+    def _entries(self):
+        if not os.path.exists(self.folder):
+            return []
+        entries = []
+        for prefix in os.listdir(self.folder):
+            prefix_folder = os.path.join(self.folder, prefix)
+            for key in os.listdir(prefix_folder):
+                entry_folder = os.path.join(prefix_folder, key)
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry_folder))
+                    entries.append((os.stat(entry_folder).st_mtime, size, entry_folder))
+                except FileNotFoundError:
+                    pass  # evicted concurrently
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used DAG folders until the cache fits within max_bytes
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_folder in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_folder, ignore_errors=True)
+            total -= size
+        self._size = total
+
+    # === DAG-LEVEL QUANTITIES
+    # Nodes are stored by their index in sorted(dag.nodes)
+
+    def cpdag(self, dag: DAG) -> PDAG:
+        """Return the essential graph of dag, with every compelled arc marked as known.
+        It is stored as one row (i, j, directed) per adjacency, so that its size is linear in the number of arcs.
+        """
+        node_list = sorted(dag.nodes)
+        adjacencies = self.get_or_compute(dag_hash(dag), 'cpdag_adjacencies', lambda: self._cpdag_adjacencies(dag, node_list))
+        arcs = {(node_list[i], node_list[j]) for i, j, directed in adjacencies.tolist() if directed}
+        edges = {(node_list[i], node_list[j]) for i, j, directed in adjacencies.tolist() if not directed}
+        return PDAG(node_list, arcs, edges, known_arcs=arcs)
+
+    @staticmethod
+    def _cpdag_adjacencies(dag, node_list):
+        node2ix = {node: i for i, node in enumerate(node_list)}
+        cpdag = PDAG.from_dag(dag)
+        rows = [(node2ix[i], node2ix[j], 1) for i, j in cpdag.arcs]
+        rows.extend((*sorted((node2ix[i], node2ix[j])), 0) for i, j in cpdag.edges)
+        return np.array(sorted(rows), dtype=np.int64).reshape(-1, 3)
+
+    def covered_edges(self, dag: DAG) -> set:
+        node_list = sorted(dag.nodes)
+        node2ix = {node: i for i, node in enumerate(node_list)}
+        covered_edges = self.get_or_compute(
+            dag_hash(dag), 'covered_edges',
+            lambda: np.array([(node2ix[u], node2ix[v]) for u, v in compute_covered_edges_fast(dag.to_nx())], dtype=np.int64).reshape(-1, 2)
+        )
+        return {(node_list[i], node_list[j]) for i, j in covered_edges}
+
+    def atomic_verification(self, dag: DAG) -> set:
+        node_list = sorted(dag.nodes)
+        node2ix = {node: i for i, node in enumerate(node_list)}
+        mvc = self.get_or_compute(
+            dag_hash(dag), 'atomic_verification',
+            lambda: np.array(sorted(node2ix[v] for v in atomic_verification_fast(dag.to_nx())), dtype=np.int64)
+        )
+        return {node_list[i] for i in mvc}
+
+    # Running times are not cached: a time read back from the cache would not be a measurement of the current run
+    OUTCOME_FIELDS = ('interventions', 'rounds', 'meek_arcs', 'cost')
+
+    def policy_outcome(self, dag: DAG, alg: str):
+        """Return the cached outcome of policy alg on dag as a dict with keys OUTCOME_FIELDS, or None.
+        Fields that the policy does not report are None. alg should identify the policy's code as well as its name
+        (see alg_runner.policy_fingerprint), so that outcomes of an older version are never returned.
+        """
+        outcome = self.get(dag_hash(dag), f'alg={alg}')
+        if outcome is None:
+            return None
+        outcome = dict(zip(self.OUTCOME_FIELDS, outcome.tolist()))
+        return {
+            field: None if field not in outcome or outcome[field] != outcome[field] else (float if field == 'cost' else int)(outcome[field])
+            for field in self.OUTCOME_FIELDS
+        }
+
+    def put_policy_outcome(self, dag: DAG, alg: str, outcome: dict):
+        values = [np.nan if outcome.get(field) is None else outcome[field] for field in self.OUTCOME_FIELDS]
+        self.put(dag_hash(dag), f'alg={alg}', np.array(values, dtype=float))
@@ -0,0 +1,180 @@
+"""
+Single-file, memory-mapped storage for all DAGs of one experimental setting
+
+Layout (little-endian):
+    header   magic b'DAGCORP1', then int64 num_dags, int64 num_arcs, int64 index_offset
+    arcs     int32[num_arcs, 2], the arcs of all DAGs back to back (CSR-style edge list)
+    nnodes   int32[num_dags], number of nodes of each DAG; DAG i has nodes 0..nnodes[i]-1
+    offsets  int64[num_dags+1], the arcs of DAG i are arcs[offsets[i]:offsets[i+1]]
+"""
+
+import os
+import pickle
+import numpy as np
+from causaldag import DAG
+
+MAGIC = b'DAGCORP1'
+HEADER = np.dtype([('magic', 'S8'), ('num_dags', '<i8'), ('num_arcs', '<i8'), ('index_offset', '<i8')])
+
+
+class DagCorpusWriter:
+    """
+    Append DAGs one at a time; arcs are streamed to disk and only the O(num_dags) index is kept in memory.
+    The corpus is written to filename.partial and only appears under filename once close() succeeds.
+
+    checkpoint() makes everything appended so far durable: it syncs the partial file and atomically writes the index,
+    together with any extra state of the caller, to filename.partial.ckpt. With resume=True, a writer picks up from the
+    last checkpoint of an interrupted run, dropping anything appended after it.
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self._partial_filename = f'{filename}.partial'
+        self._checkpoint_filename = f'{filename}.partial.ckpt'
+        self.checkpoint_state = dict()
+        if resume and os.path.exists(self._partial_filename) and os.path.exists(self._checkpoint_filename):
+            with open(self._checkpoint_filename, 'rb') as f:
+                checkpoint = pickle.load(f)
+            self._nnodes = checkpoint['nnodes']
+            self._offsets = checkpoint['offsets']
+            self.checkpoint_state = checkpoint['state']
+            self._file = open(self._partial_filename, 'r+b')
+            self._file.truncate(HEADER.itemsize + 8 * self._offsets[-1])
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(self._partial_filename, 'wb')
+            self._file.write(np.zeros(1, dtype=HEADER).tobytes())
+            self._nnodes = []
+            self._offsets = [0]
+            if os.path.exists(self._checkpoint_filename):
+                os.remove(self._checkpoint_filename)
+
+    @property
+    def num_dags(self):
+        return len(self._nnodes)
+
+    def append(self, dag):
+        """Append a DAG, given as a causaldag DAG or as an adjacency matrix (amat[i,j] != 0 iff i->j).
+        As in DAG.to_amat, nodes are relabelled by their index in sorted(dag.nodes).
+        """
+        nnodes, arcs = dag_arcs(dag)
+        self._file.write(arcs.tobytes())
+        self._nnodes.append(nnodes)
+        self._offsets.append(self._offsets[-1] + len(arcs))
+
+    def checkpoint(self, **state):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        tmp_filename = f'{self._checkpoint_filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(dict(nnodes=self._nnodes, offsets=self._offsets, state=state), f)
+        os.replace(tmp_filename, self._checkpoint_filename)
+        self.checkpoint_state = state
+
+    def written_dags(self):
+        """Iterate over the DAGs appended so far, including those recovered from a checkpoint
+        """
+        self._file.flush()
+        arcs = np.fromfile(self._partial_filename, dtype='<i4', count=2 * self._offsets[-1], offset=HEADER.itemsize).reshape(-1, 2)
+        for ix, nnodes in enumerate(self._nnodes):
+            yield dag_from_arcs(nnodes, arcs[self._offsets[ix]:self._offsets[ix + 1]])
+
+    def close(self):
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._nnodes, dtype='<i4').tobytes())
+        self._file.write(np.array(self._offsets, dtype='<i8').tobytes())
+        self._file.seek(0)
+        self._file.write(np.array([(MAGIC, len(self._nnodes), self._offsets[-1], index_offset)], dtype=HEADER).tobytes())
+        self._file.close()
+        os.replace(self._partial_filename, self.filename)
+        if os.path.exists(self._checkpoint_filename):
+            os.remove(self._checkpoint_filename)
+
+    def release(self):
+        """Close the partial file but keep it and its last checkpoint, so that a later writer can resume from them
+        """
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._partial_filename)
+        if os.path.exists(self._checkpoint_filename):
+            os.remove(self._checkpoint_filename)
+
+
+'''
+Return the number of nodes and the (num_arcs, 2) int32 array of sorted arcs of a DAG, given as a causaldag DAG or as an adjacency matrix, in the layout of the corpus
+As in DAG.to_amat, nodes are relabelled by their index in sorted(dag.nodes)
+'''
+def dag_arcs(dag):
+    if isinstance(dag, np.ndarray):
+        nnodes = dag.shape[0]
+        arcs = np.argwhere(dag != 0)
+    else:
+        node2ix = {node: i for i, node in enumerate(sorted(dag.nodes))}
+        nnodes = len(node2ix)
+        arcs = np.array(sorted((node2ix[i], node2ix[j]) for i, j in dag.arcs), dtype=np.int64).reshape(-1, 2)
+    return nnodes, arcs.astype('<i4')
+
+'''
+Build a causaldag DAG on nodes 0..nnodes-1 from a (num_arcs, 2) array of arcs
+'''
+def dag_from_arcs(nnodes, arcs) -> DAG:
+    return DAG(nodes=set(range(nnodes)), arcs=set(map(tuple, arcs.tolist())))
+
+
+'''
+Write all DAGs of an iterable (causaldag DAGs or adjacency matrices) to a corpus file
+'''
+def write_dag_corpus(filename, dags):
+    writer = DagCorpusWriter(filename)
+    try:
+        for dag in dags:
+            writer.append(dag)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+class DagCorpus:
+    """
+    Read-only view of a corpus file. Arc lists are zero-copy views into the memory map, so several processes reading
+    the same corpus share one page-cached copy.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        header = np.fromfile(filename, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError(f'{filename} is not a DAG corpus')
+        num_dags = int(header['num_dags'])
+        num_arcs = int(header['num_arcs'])
+        index_offset = int(header['index_offset'])
+        self._arcs = np.memmap(filename, dtype='<i4', mode='r', offset=HEADER.itemsize, shape=(num_arcs, 2)) if num_arcs > 0 else np.zeros((0, 2), dtype='<i4')
+        self._nnodes = np.memmap(filename, dtype='<i4', mode='r', offset=index_offset, shape=(num_dags,)) if num_dags > 0 else np.zeros(0, dtype='<i4')
+        self._offsets = np.memmap(filename, dtype='<i8', mode='r', offset=index_offset + 4 * num_dags, shape=(num_dags + 1,))
+
+    def __len__(self):
+        return len(self._nnodes)
+
+    def nnodes(self, ix) -> int:
+        return int(self._nnodes[ix])
+
+    def num_arcs(self, ix) -> int:
+        return int(self._offsets[ix + 1] - self._offsets[ix])
+
+    def arcs(self, ix) -> np.ndarray:
+        """Return the (num_arcs, 2) array of arcs of DAG ix, as a view into the memory map
+        """
+        return self._arcs[self._offsets[ix]:self._offsets[ix + 1]]
+
+    def amat(self, ix) -> np.ndarray:
+        amat = np.zeros((self.nnodes(ix), self.nnodes(ix)), dtype=int)
+        arcs = self.arcs(ix)
+        amat[arcs[:, 0], arcs[:, 1]] = 1
+        return amat
+
+    def __getitem__(self, ix) -> DAG:
+        return dag_from_arcs(self.nnodes(ix), self.arcs(ix))
+
+    def __iter__(self):
+        return (self[ix] for ix in range(len(self)))
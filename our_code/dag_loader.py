@@ -1,4 +1,5 @@
 import os
+import random
 from config import DATA_FOLDER
 from random_graphs import random_chordal_graph2, tree_plus, hairball_plus, tree_of_cliques, random_chordal_graph, shanmugam_random_chordal
 import numpy as np
@@ -10,6 +11,19 @@ from graph_utils import get_directed_clique_graph
 from mixed_graph import LabelledMixedGraph
 
 from verify import *
+from dag_cache import DagCache
+from dag_corpus import DagCorpus, DagCorpusWriter
+
+# Seed of the per-node intervention costs, see node_costs
+COST_SEED = 5021
+
+'''
+Per-node intervention costs of DAG ix of a setting, indexed by node (corpus DAGs have nodes 0..nnodes-1): i.i.d. lognormal with log-scale cost_sigma, so that a few nodes are orders of magnitude more expensive than the rest.
+The costs only depend on (cost_sigma, ix, nnodes), so every worker regenerates the same vector instead of reading it from disk, and reruns and resumed runs see the same costs.
+'''
+def node_costs(cost_sigma, ix, nnodes):
+    return np.random.default_rng([COST_SEED, ix, nnodes]).lognormal(0, cost_sigma, nnodes)
+
 
 class DagSampler(Enum):
     CHORDAL2 = 1
@@ -21,132 +35,210 @@ class DagSampler(Enum):
 
 
 class DagLoader:
-    def __init__(self, nnodes: int, num_dags: int, sampler: DagSampler, other_params: dict, comparable_edges=False):
+    def __init__(self, nnodes: int, num_dags: int, sampler: DagSampler, other_params: dict, comparable_edges=False, cost_sigma=None):
         self.nnodes = nnodes
         self.other_params = other_params
         self.num_dags = num_dags
         self.sampler = sampler
         self.comparable_edges = comparable_edges
+        self.cost_sigma = cost_sigma
+
+    @property
+    def params_str(self):
+        return ','.join([f"{key}={value}" for key, value in self.other_params.items()])
 
     @property
     def dag_folder(self):
-        other_params = ','.join([f"{key}={value}" for key, value in self.other_params.items()])
-        return os.path.join(DATA_FOLDER, f'sampler={self.sampler.name},nnodes={self.nnodes},num_dags={self.num_dags},{other_params}')
+        return os.path.join(DATA_FOLDER, f'sampler={self.sampler.name},nnodes={self.nnodes},num_dags={self.num_dags},{self.params_str}')
+
+    @property
+    def setting(self):
+        """The columns that identify this setting in the ResultsStore. Settings with intervention costs share the DAGs
+        of the setting without costs, but not its results.
+        """
+        params = self.params_str if self.cost_sigma is None else f'{self.params_str},cost_sigma={self.cost_sigma}'
+        return dict(sampler=self.sampler.name, params=params, nnodes=self.nnodes, num_dags=self.num_dags)
+
+    def costs(self, ix, nnodes):
+        """Return the per-node intervention costs of DAG ix (with nnodes nodes), or None for unit costs
+        """
+        return None if self.cost_sigma is None else node_costs(self.cost_sigma, ix, nnodes)
 
     @property
     def dag_filenames(self):
         return [os.path.join(self.dag_folder, 'dags', f'dag{i}.npy') for i in range(self.num_dags)]
 
-    def get_dags(self, overwrite=False):
-
-        if overwrite or not os.path.exists(self.dag_folder):
-            print(f'[DagLoader.get_dags] Generating DAGs for {self.dag_folder}')
-            dags = []
-            counter = 0
-            while len(dags) < self.num_dags:
-                counter += 1
-                if counter > 100:
-                    raise RuntimeError('change parameters, not getting incomparable graphs')
-                if self.sampler == DagSampler.CHORDAL2:
-                    d = DAG.from_nx(random_chordal_graph2(self.nnodes, self.other_params['density']))
-                elif self.sampler == DagSampler.TREE_PLUS:
-                    d = DAG.from_nx(tree_plus(self.nnodes, self.other_params['e_min'], self.other_params['e_max']))
-                elif self.sampler == DagSampler.HAIRBALL_PLUS:
-                    if self.other_params.get('e_min') is not None:
-                        d = DAG.from_nx(hairball_plus(
-                            self.other_params['degree'],
-                            self.other_params['e_min'],
-                            self.other_params['e_max'],
-                            num_layers=self.other_params.get('num_layers'),
-                            nnodes=self.nnodes
-                        ))
-                    elif self.other_params.get('edge_prob') is not None:
-                        d = DAG.from_nx(hairball_plus(
-                            self.other_params['degree'],
-                            nnodes=self.nnodes,
-                            edge_prob=self.other_params['edge_prob']
-                        ))
-                    else:
-                        d = DAG.from_nx(hairball_plus(
-                            self.other_params['degree'],
-                            nnodes=self.nnodes,
-                            nontree_factor=self.other_params['nontree_factor']
-                        ))
-                elif self.sampler == DagSampler.TREE_OF_CLIQUES:
-                    d = DAG.from_nx(tree_of_cliques(
-                        self.other_params['degree'],
-                        self.other_params['min_clique_size'],
-                        self.other_params['max_clique_size'],
-                        nnodes=self.other_params.get('nnodes')
-                    ))
-                elif self.sampler == DagSampler.ERDOS:
-                    d = DAG.from_nx(random_chordal_graph(
-                        self.nnodes,
-                        p=self.other_params['density']
-                    ))
-                elif self.sampler == DagSampler.SHANMUGAM:
-                    d = DAG.from_nx(shanmugam_random_chordal(self.nnodes, self.other_params['density']))
-                else:
-                    raise ValueError
-
-                # print(f'[DagLoader.get_dags] Checking edge comparability: {self.comparable_edges}')
-                if self.comparable_edges or get_directed_clique_graph(d) == LabelledMixedGraph.from_nx(d.directed_clique_tree()):
-                    counter = 0
-                    dags.append(d)
-                    # print(len(dags))
-
-            print('[DagLoader.get_dags] checking v-structures')
-            if any(len(d.vstructures()) > 0 for d in dags):
-                print([len(d.vstructures()) for d in dags])
-                raise ValueError("DAG has v-structures")
-
-            print('[DagLoader.get_dags] checking chordality')
-            for d in dags:
-                d_nx = d.to_nx().to_undirected()
-                if not nx.is_chordal(d_nx):
-                    raise RuntimeError
-                if not nx.is_connected(d_nx):
-                    raise RuntimeError
-
-            print(f'[DagLoader.get_dags] saving DAGs to {self.dag_folder}')
-            os.makedirs(os.path.join(self.dag_folder, 'dags'), exist_ok=True)
-            for dag, filename in zip(dags, self.dag_filenames):
-                np.save(filename, dag.to_amat()[0])
+    @property
+    def corpus_filename(self):
+        return os.path.join(self.dag_folder, 'dags.corpus')
+
+    def has_dags(self):
+        # Folders generated before the corpus format hold one dag{i}.npy file per DAG instead
+        return os.path.exists(self.corpus_filename) or all(os.path.exists(filename) for filename in self.dag_filenames)
+
+    def get_corpus(self) -> DagCorpus:
+        """
+        Return a memory-mapped reader over all DAGs of this setting, packing legacy dag{i}.npy files into a corpus first.
+        """
+        if not os.path.exists(self.corpus_filename):
+            writer = DagCorpusWriter(self.corpus_filename)
+            for filename in self.dag_filenames:
+                writer.append(np.load(filename))
+            writer.close()
+        return DagCorpus(self.corpus_filename)
+
+    def _sample_dag(self):
+        if self.sampler == DagSampler.CHORDAL2:
+            return DAG.from_nx(random_chordal_graph2(self.nnodes, self.other_params['density']))
+        elif self.sampler == DagSampler.TREE_PLUS:
+            return DAG.from_nx(tree_plus(self.nnodes, self.other_params['e_min'], self.other_params['e_max']))
+        elif self.sampler == DagSampler.HAIRBALL_PLUS:
+            if self.other_params.get('e_min') is not None:
+                return DAG.from_nx(hairball_plus(
+                    self.other_params['degree'],
+                    self.other_params['e_min'],
+                    self.other_params['e_max'],
+                    num_layers=self.other_params.get('num_layers'),
+                    nnodes=self.nnodes
+                ))
+            elif self.other_params.get('edge_prob') is not None:
+                return DAG.from_nx(hairball_plus(
+                    self.other_params['degree'],
+                    nnodes=self.nnodes,
+                    edge_prob=self.other_params['edge_prob']
+                ))
+            else:
+                return DAG.from_nx(hairball_plus(
+                    self.other_params['degree'],
+                    nnodes=self.nnodes,
+                    nontree_factor=self.other_params['nontree_factor']
+                ))
+        elif self.sampler == DagSampler.TREE_OF_CLIQUES:
+            return DAG.from_nx(tree_of_cliques(
+                self.other_params['degree'],
+                self.other_params['min_clique_size'],
+                self.other_params['max_clique_size'],
+                nnodes=self.other_params.get('nnodes')
+            ))
+        elif self.sampler == DagSampler.ERDOS:
+            return DAG.from_nx(random_chordal_graph(
+                self.nnodes,
+                p=self.other_params['density']
+            ))
+        elif self.sampler == DagSampler.SHANMUGAM:
+            return DAG.from_nx(shanmugam_random_chordal(self.nnodes, self.other_params['density']))
         else:
-            print(f'[DagLoader.get_dags] Loading DAGs from {self.dag_folder}')
-            dags = [DAG.from_amat(np.load(filename)) for filename in self.dag_filenames]
+            raise ValueError
+
+    def _check_dag(self, d):
+        if len(d.vstructures()) > 0:
+            print(len(d.vstructures()))
+            raise ValueError("DAG has v-structures")
+
+        d_nx = d.to_nx().to_undirected()
+        if not nx.is_chordal(d_nx):
+            raise RuntimeError
+        if not nx.is_connected(d_nx):
+            raise RuntimeError
+
+    def iter_dags(self, overwrite=False):
+        """
+        Return an iterator over the DAGs that yields them one at a time, so that memory stays flat regardless of num_dags.
+        When generating, each DAG is sampled, checked for v-structures and chordality, and checkpointed to the partial
+        corpus file before it is yielded; the corpus only becomes visible once the last DAG has been written.
+        An interrupted generation is resumed from its last checkpoint unless overwrite is set.
+        Whether to generate or load is decided when iter_dags is called, not when the iterator is first advanced.
+        """
+        if overwrite or not self.has_dags():
+            print(f'[DagLoader.iter_dags] Generating DAGs for {self.dag_folder}')
+            os.makedirs(self.dag_folder, exist_ok=True)
+            if overwrite:
+                # Remove the old DAGs right away, so that an interrupted regeneration is resumed instead of being shadowed by them
+                for filename in [self.corpus_filename] + self.dag_filenames:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+            return self._generate_dags(resume=not overwrite)
+        else:
+            print(f'[DagLoader.iter_dags] Loading DAGs from {self.dag_folder}')
+            return iter(self.get_corpus())
+
+    def _generate_dags(self, resume=True):
+        writer = DagCorpusWriter(self.corpus_filename, resume=resume)
+        try:
+            if writer.num_dags > 0:
+                # Restore the random state of the checkpoint, so that the resumed run samples the same DAGs as an uninterrupted one
+                print(f'[DagLoader.iter_dags] Resuming from DAG {writer.num_dags}')
+                random.setstate(writer.checkpoint_state['random_state'])
+                np.random.set_state(writer.checkpoint_state['np_random_state'])
+                yield from writer.written_dags()
+
+            for _ in range(writer.num_dags, self.num_dags):
+                counter = 0
+                while True:
+                    counter += 1
+                    if counter > 100:
+                        raise RuntimeError('change parameters, not getting incomparable graphs')
+                    d = self._sample_dag()
+
+                    # print(f'[DagLoader.get_dags] Checking edge comparability: {self.comparable_edges}')
+                    if self.comparable_edges or get_directed_clique_graph(d) == LabelledMixedGraph.from_nx(d.directed_clique_tree()):
+                        break
+
+                self._check_dag(d)
+                writer.append(d)
+                writer.checkpoint(random_state=random.getstate(), np_random_state=np.random.get_state())
+                yield d
+        except BaseException:
+            # Keep the partial corpus and its last checkpoint to resume from
+            writer.release()
+            raise
+        writer.close()
 
+    def get_dags(self, overwrite=False):
+        dags = list(self.iter_dags(overwrite=overwrite))
         print(f'Average sparsity: {np.mean([dag.sparsity for dag in dags])}')
         return dags
 
-    def get_verification_optimal_ivs(self, overwrite=False):
-        filename = os.path.join(self.dag_folder, 'optimal_num_interventions.txt')
-        if overwrite or not os.path.exists(filename):
+    @property
+    def verification_filename(self):
+        return os.path.join(self.dag_folder, 'optimal_num_interventions.txt')
+
+    def has_verification_optimal_ivs(self):
+        return os.path.exists(self.verification_filename)
+
+    def save_verification_optimal_ivs(self, optimal_ivs):
+        os.makedirs(self.dag_folder, exist_ok=True)
+        tmp_filename = f'{self.verification_filename}.{os.getpid()}.tmp'
+        np.savetxt(tmp_filename, optimal_ivs)
+        os.replace(tmp_filename, self.verification_filename)
+
+    def get_verification_optimal_ivs(self, overwrite=False, use_cache=True):
+        if overwrite or not self.has_verification_optimal_ivs():
             print('[DagLoader.get_verification_optimal_ivs] computing MVISs')
+            cache = DagCache()
             optimal_ivs = np.array(list(tqdm(
                 #(len(dag.optimal_fully_orienting_interventions(new=True)) for dag in self.get_dags()),
-                (len(atomic_verification(dag.to_nx())) for dag in self.get_dags()),
+                (len(cache.atomic_verification(dag) if use_cache else atomic_verification_fast(dag.to_nx())) for dag in self.iter_dags()),
                 total=self.num_dags
             )))
-            np.savetxt(filename, optimal_ivs)
+            self.save_verification_optimal_ivs(optimal_ivs)
         else:
-            optimal_ivs = np.loadtxt(filename)
+            optimal_ivs = np.loadtxt(self.verification_filename)
 
-        for d, o in zip(self.get_dags(), optimal_ivs):
-            if o == 0:
-                raise ValueError
+        if np.any(optimal_ivs == 0):
+            raise ValueError
         print(f'Average MVIS: {optimal_ivs.mean()}')
         return optimal_ivs
 
     def max_clique_sizes(self):
         clique_numbers = np.array([
             max(map(len, nx.chordal_graph_cliques(dag.to_nx().to_undirected())))
-            for dag in self.get_dags()
+            for dag in self.iter_dags()
         ])
         return clique_numbers
 
     def num_cliques(self):
-        return np.array([len(nx.chordal_graph_cliques(dag.to_nx().to_undirected())) for dag in self.get_dags()])
+        return np.array([len(nx.chordal_graph_cliques(dag.to_nx().to_undirected())) for dag in self.iter_dags()])
 
 
 if __name__ == '__main__':
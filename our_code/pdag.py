@@ -6,15 +6,444 @@ Base class for partially directed acyclic graphs
 from collections import defaultdict
 from causaldag.utils import core_utils
 import itertools as itr
+import random
 import numpy as np
 from typing import Set
-from collections import namedtuple
-from scipy.special import factorial
+from math import factorial
 import networkx as nx
 from typing import Set, FrozenSet, Iterable
 import csv
 
-SmallDag = namedtuple('SmallDag', ['arcs', 'reversible_arcs', 'parents_dict', 'children_dict', 'level'])
+# Above this many nodes, PDAG.to_complete_pdag_amat uses the set-based propagation instead of the dense matrix sweeps
+AMAT_MAX_NODES = 500
+
+
+def meek_closure_amat(directed, undirected):
+    """
+    Apply the Meek rules of PDAG.to_complete_pdag to a PDAG given as adjacency matrices, until a fixpoint is reached.
+
+    Dense inputs are closed by dense matrix sweeps. Each sweep orients, all at once, every edge that is forced by one
+    of the configurations:
+    (a) k->i--j with k and j nonadjacent, (b) i->k->j with i--j, (d) i--k1->j<-k2--i with k1 and k2 nonadjacent.
+    (a) and (b) are single matrix products and (d) is one product per node with at least two parents, so the
+    per-sweep cost is dominated by BLAS calls rather than by Python loops over arcs. This takes O(n^2) memory and
+    O(n^3) time per sweep, which only pays off on small, dense graphs.
+
+    Sparse inputs are never densified: they are closed by the set-based propagation of PDAG (see PDAG._propagate),
+    whose cost grows with the number of edges rather than with n^2.
+
+    Parameters
+    ----------
+    directed:
+        n x n matrix with directed[i, j] != 0 iff i->j. Dense NumPy array or scipy sparse matrix.
+    undirected:
+        symmetric n x n matrix with undirected[i, j] != 0 iff i--j. Dense NumPy array or scipy sparse matrix.
+
+    Return
+    ------
+    (directed, undirected)
+        Boolean matrices of the completed PDAG: NumPy arrays if both inputs are dense, scipy CSR matrices otherwise.
+    """
+    from scipy.sparse import issparse
+    if issparse(directed) or issparse(undirected):
+        return _meek_closure_sparse(directed, undirected)
+    D = np.array(directed, dtype=bool)
+    U = np.array(undirected, dtype=bool)
+
+    # Adjacencies never change, only their orientation. float32 products are exact for counts below 2^24.
+    nonadjacent = ~(D | D.T | U)
+    np.fill_diagonal(nonadjacent, False)
+    nonadjacent = nonadjacent.astype(np.float32)
+
+    while U.any():
+        Df = D.astype(np.float32)
+
+        # configuration (a) -- causal chain
+        forced = (Df.T @ nonadjacent) > 0
+        # configuration (b) -- acyclicity
+        forced |= (Df @ Df) > 0
+        forced &= U
+
+        # configuration (d)
+        Uf = U.astype(np.float32)
+        for j in np.flatnonzero((D.sum(axis=0) >= 2) & U.any(axis=0)):
+            k = np.flatnonzero(D[:, j])
+            W = Uf[:, k]
+            forced[:, j] |= U[:, j] & (((W @ nonadjacent[np.ix_(k, k)]) * W).sum(axis=1) > 0)
+
+        # An edge forced both ways only happens if the PDAG has no consistent extension; leave it undirected
+        new_arcs = forced & ~forced.T
+        if not new_arcs.any():
+            break
+        D |= new_arcs
+        U &= ~(new_arcs | new_arcs.T)
+
+    return D, U
+
+
+def _meek_closure_sparse(directed, undirected):
+    """
+    meek_closure_amat for sparse inputs, through PDAG._propagate on nodes 0..n-1. Return CSR boolean matrices.
+    """
+    from scipy.sparse import coo_matrix, csr_matrix
+    directed = coo_matrix(directed)
+    undirected = coo_matrix(undirected)
+    n = directed.shape[0]
+    pdag = PDAG(
+        set(range(n)),
+        set(zip(directed.row.tolist(), directed.col.tolist())),
+        {(i, j) for i, j in zip(undirected.row.tolist(), undirected.col.tolist()) if i < j}
+    )
+    pdag._propagate(list(range(n)))
+
+    def to_csr(pairs):
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        return csr_matrix((np.ones(len(pairs), dtype=bool), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    edges = [tuple(edge) for edge in pdag._edges]
+    return to_csr(list(pdag._arcs)), to_csr(edges + [(j, i) for i, j in edges])
+
+
+def _is_moral_dag(nnodes, rows, cols):
+    """
+    Return whether the DAG with arcs zip(rows, cols) on nodes 0..nnodes-1 has no v-structures, in O(n + m).
+
+    The parents of every node form a clique iff all of them but the last one in a topological order are parents of
+    that last one (by induction over the topological order, as in the check of a perfect elimination ordering).
+    """
+    parents = [set() for _ in range(nnodes)]
+    children = [[] for _ in range(nnodes)]
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        parents[j].add(i)
+        children[i].append(j)
+
+    indegree = [len(node_parents) for node_parents in parents]
+    order = [node for node in range(nnodes) if indegree[node] == 0]
+    for node in order:
+        for child in children[node]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                order.append(child)
+    position = [0] * nnodes
+    for ix, node in enumerate(order):
+        position[node] = ix
+
+    for node_parents in parents:
+        if len(node_parents) >= 2:
+            last = max(node_parents, key=position.__getitem__)
+            if not (node_parents - {last}) <= parents[last]:
+                return False
+    return True
+
+
+def _vstructure_arcs_amat(amat):
+    """
+    Return (rows, cols, in_vstructure) for the arcs rows[k]->cols[k] of the DAG with adjacency matrix amat, where
+    in_vstructure is a boolean mask of the arcs in v-structures, or None if there are none.
+
+    Moral DAGs (no v-structures, as produced by most of our samplers) are recognized in O(n + m). Otherwise the mask
+    comes from one sparse matrix product: i->j is in a v-structure iff j has more parents than the ones adjacent to i,
+    plus i itself.
+    """
+    from scipy.sparse import csr_matrix
+    A = csr_matrix(amat, dtype=np.int32)
+    A.eliminate_zeros()
+    A.data[:] = 1
+    rows, cols = A.nonzero()
+    if _is_moral_dag(A.shape[0], rows, cols):
+        return rows, cols, None
+
+    indegree = np.asarray(A.sum(axis=0)).ravel()
+    parents_adjacent = np.asarray(((A + A.T) @ A)[rows, cols]).ravel()
+    return rows, cols, indegree[cols] - 1 > parents_adjacent
+
+
+def cpdag_from_amat(amat):
+    """
+    Return the essential graph of the DAG with adjacency matrix amat (dense NumPy array or scipy sparse matrix, with
+    amat[i, j] != 0 iff i->j), as integer arrays (arcs, edges) of shape (*, 2), with i < j for every edge (i, j).
+    See PDAG.from_dag_amat.
+    """
+    pdag = PDAG.from_dag_amat(amat)
+    arcs = np.array(sorted(pdag._arcs), dtype=np.int64).reshape(-1, 2)
+    edges = np.array(sorted(tuple(sorted(edge)) for edge in pdag._edges), dtype=np.int64).reshape(-1, 2)
+    return arcs, edges
+
+def _mcs_clique_tree(nodes, adj):
+    """
+    Return the maximal cliques of a connected chordal graph and a clique tree over them, from one maximum cardinality
+    search (Blair and Peyton, An introduction to chordal graphs and clique trees, Algorithm 4.8).
+
+    Parameters
+    ----------
+    nodes:
+        the vertex set of the graph.
+    adj:
+        dict from every node to a set of neighbors; neighbors outside of nodes are ignored.
+
+    Return
+    ------
+    (cliques, parents)
+        cliques is a list of frozensets, and parents[c] is the index of the parent of clique c in the clique tree
+        (always smaller than c), or None for the root cliques[0].
+    """
+    nodes = set(nodes)
+    weight = {node: 0 for node in nodes}
+    buckets = defaultdict(set)
+    buckets[0] = set(nodes)
+    max_weight = 0
+    visited = dict()  # node -> visit number
+
+    cliques = []
+    parents = []
+    clique_of = dict()
+    prev_card = -1
+    while buckets[max_weight] or max_weight > 0:
+        if not buckets[max_weight]:
+            max_weight -= 1
+            continue
+        node = buckets[max_weight].pop()
+        visited_nbrs = {nbr for nbr in adj[node] if nbr in visited}
+        if len(visited_nbrs) <= prev_card or not cliques:
+            # node starts a new clique, attached to the clique of its most recently visited neighbor
+            cliques.append(set(visited_nbrs) | {node})
+            parents.append(clique_of[max(visited_nbrs, key=visited.get)] if visited_nbrs else None)
+        else:
+            cliques[-1].add(node)
+        clique_of[node] = len(cliques) - 1
+        prev_card = len(visited_nbrs)
+        visited[node] = len(visited)
+        del weight[node]
+
+        for nbr in adj[node]:
+            if nbr in weight:
+                buckets[weight[nbr]].remove(nbr)
+                weight[nbr] += 1
+                buckets[weight[nbr]].add(nbr)
+        max_weight += 1
+
+    return [frozenset(clique) for clique in cliques], parents
+
+
+def _count_prefix_free_orders(clique, prefixes):
+    """
+    Return the number of orderings of clique that do not start with any of the sets in prefixes, a chain of subsets of
+    clique ordered by inclusion (the phi function of Wienöbst et al.).
+    """
+    counts = []
+    for i, prefix in enumerate(prefixes):
+        counts.append(factorial(len(prefix)) - sum(
+            factorial(len(prefix) - len(prefixes[j])) * counts[j] for j in range(i)
+        ))
+    return factorial(len(clique)) - sum(
+        factorial(len(clique) - len(prefix)) * count for prefix, count in zip(prefixes, counts)
+    )
+
+
+def _clique_subproblems(nodes, adj, clique):
+    """
+    Orient the connected chordal graph on nodes with clique first, and propagate the Meek rules.
+
+    Return
+    ------
+    (arcs, subproblems)
+        the arcs oriented outside of clique, and the remaining chain components as frozensets of nodes; each of them
+        is an induced subgraph of the graph on nodes.
+    """
+    nodes = set(nodes)
+    pdag = PDAG(nodes, edges={frozenset((i, j)) for i in nodes for j in adj[i] if j in nodes})
+    pdag._orient_and_propagate({(i, j) for i in clique for j in adj[i] if j in nodes and j not in clique})
+    subproblems = [frozenset(component) for component in pdag.chain_component_nodes() if not clique.issuperset(component)]
+    return list(pdag._arcs), subproblems
+
+
+def _is_tree_or_clique(nodes, adj):
+    """Return 'tree' or 'clique' if the connected graph on nodes is one (a single edge is a tree), else None
+    """
+    num_edges = sum(len(adj[node] & nodes) for node in nodes) // 2
+    if num_edges == len(nodes) - 1:
+        return 'tree'
+    if num_edges == len(nodes) * (len(nodes) - 1) // 2:
+        return 'clique'
+    return None
+
+
+def _orient_tree(nodes, adj, root):
+    """Return the arcs of the tree on nodes oriented away from root
+    """
+    arcs = []
+    visited = {root}
+    queue = [root]
+    for node in queue:
+        for nbr in adj[node] & nodes:
+            if nbr not in visited:
+                visited.add(nbr)
+                queue.append(nbr)
+                arcs.append((node, nbr))
+    return arcs
+
+
+def _iter_product(factories):
+    """Yield the concatenations of one list from each of the generators returned by factories, recreating the later
+    generators instead of storing what they yielded
+    """
+    if not factories:
+        yield []
+        return
+    for first in factories[0]():
+        for rest in _iter_product(factories[1:]):
+            yield first + rest
+
+
+def _iter_amos(nodes, adj, choices):
+    """
+    Yield the arcs of every acyclic moral orientation of the connected chordal graph on nodes exactly once, as lists.
+    Follows the partition of Clique-Picking: for each clique in choices[nodes] (as filled by _count_amos), each of its
+    orderings counted there, combined with every orientation of each remaining subproblem.
+    """
+    kind = _is_tree_or_clique(nodes, adj)
+    if kind == 'tree':
+        for root in nodes:
+            yield _orient_tree(nodes, adj, root)
+    elif kind == 'clique':
+        for order in itr.permutations(nodes):
+            yield list(itr.combinations(order, 2))
+    else:
+        for _, clique, prefixes, arcs, subproblems in choices[nodes]:
+            factories = [lambda subproblem=subproblem: _iter_amos(subproblem, adj, choices) for subproblem in subproblems]
+            for order in itr.permutations(clique):
+                if any(prefix.issuperset(order[:len(prefix)]) for prefix in prefixes):
+                    continue
+                clique_arcs = list(itr.combinations(order, 2)) + arcs
+                for subproblem_arcs in _iter_product(factories):
+                    yield clique_arcs + subproblem_arcs
+
+
+def _count_amos(nodes, adj, memo, choices=None):
+    """
+    Return the number of acyclic moral orientations of the connected chordal graph on nodes, by Clique-Picking
+    (Wienöbst, Bannach and Liskiewicz, Polynomial-Time Algorithms for Counting and Sampling Markov Equivalent DAGs).
+
+    Every orientation is counted once, at the clique closest to the root of the clique tree it can start with: the
+    orderings of a clique that start with the separator of an edge on its path to the root are left to that edge's
+    upper end, and the rest of the graph splits into independent subproblems. Subproblems recur across cliques, so
+    their counts are memoized in memo, keyed by their node sets.
+
+    If choices is a dict, choices[node set] is also filled, for every subproblem that is neither a tree nor a clique,
+    with one (count, clique, prefixes, arcs, subproblems) tuple per clique: the number of orientations counted at the
+    clique, the chain of separators its orderings must not start with, and the result of _clique_subproblems.
+    """
+    nodes = frozenset(nodes)
+    if nodes in memo:
+        return memo[nodes]
+    kind = _is_tree_or_clique(nodes, adj)
+    if kind == 'tree':  # one orientation per choice of root
+        return len(nodes)
+    if kind == 'clique':  # one orientation per ordering
+        return factorial(len(nodes))
+
+    cliques, parents = _mcs_clique_tree(nodes, adj)
+    total = 0
+    node_choices = []
+    for c, clique in enumerate(cliques):
+        # the separators on the path to the root that lie in clique; by the running intersection property they form a
+        # chain, growing towards clique
+        prefixes = []
+        child, ancestor = c, parents[c]
+        while ancestor is not None:
+            separator = cliques[child] & cliques[ancestor]
+            if separator <= clique and (not prefixes or separator != prefixes[-1]):
+                prefixes.append(separator)
+            child, ancestor = ancestor, parents[ancestor]
+        prefixes.sort(key=len)
+
+        count = _count_prefix_free_orders(clique, prefixes)
+        arcs, subproblems = _clique_subproblems(nodes, adj, clique)
+        for subproblem in subproblems:
+            count *= _count_amos(subproblem, adj, memo, choices)
+        total += count
+        if choices is not None and count > 0:
+            node_choices.append((count, clique, prefixes, arcs, subproblems))
+
+    memo[nodes] = total
+    if choices is not None:
+        choices[nodes] = node_choices
+    return total
+
+
+class MecSampler:
+    """
+    Uniform sampler over the DAGs in the MEC represented by a PDAG closed under the Meek rules.
+
+    The Clique-Picking counts (see _count_amos) split the orientations of every chain component by the clique they
+    start with. A DAG is sampled by picking a clique with probability proportional to its count, an ordering of the
+    clique uniformly among the ones counted at it (by rejection; at least a third of all orderings qualify), orienting
+    the arcs this forces, and doing the same for every chain component that is left. Counts and forced arcs are only
+    computed once, when the sampler is built, so each sample takes time linear in the number of edges.
+    """
+    def __init__(self, pdag):
+        self.nodes = frozenset(pdag._nodes)
+        self.arcs = frozenset(pdag._arcs)
+        self.edges = frozenset(pdag._edges)
+        self._adj = {node: set(nbrs) for node, nbrs in pdag._undirected_neighbors.items()}
+        self._components = [frozenset(component) for component in pdag.chain_component_nodes()]
+        self._choices = dict()
+        memo = dict()
+        self.size = 1
+        for component in self._components:
+            self.size *= _count_amos(component, self._adj, memo, self._choices)
+
+    def represents(self, pdag) -> bool:
+        """Return whether this sampler was built from a PDAG with the same nodes, arcs and edges as pdag
+        """
+        return self.nodes == pdag._nodes and self.arcs == pdag._arcs and self.edges == pdag._edges
+
+    def _sample_order(self, clique, prefixes):
+        order = list(clique)
+        while True:
+            random.shuffle(order)
+            if not any(prefix.issuperset(order[:len(prefix)]) for prefix in prefixes):
+                return order
+
+    def sample_arcs(self) -> set:
+        """Return the arcs of a DAG sampled uniformly at random from the MEC
+        """
+        arcs = set(self.arcs)
+        stack = list(self._components)
+        while stack:
+            nodes = stack.pop()
+            if nodes not in self._choices:
+                if _is_tree_or_clique(nodes, self._adj) == 'tree':
+                    arcs.update(_orient_tree(nodes, self._adj, random.choice(list(nodes))))
+                else:
+                    order = list(nodes)
+                    random.shuffle(order)
+                    arcs.update(itr.combinations(order, 2))
+                continue
+
+            node_choices = self._choices[nodes]
+            r = random.randrange(sum(choice[0] for choice in node_choices))
+            for count, clique, prefixes, clique_arcs, subproblems in node_choices:
+                if r < count:
+                    break
+                r -= count
+            arcs.update(itr.combinations(self._sample_order(clique, prefixes), 2))
+            arcs.update(clique_arcs)
+            stack.extend(subproblems)
+        return arcs
+
+    def iter_arcs(self):
+        """Yield the arcs of every DAG in the MEC exactly once, as lists; only one DAG per chain component is held at a time
+        """
+        factories = [lambda component=component: _iter_amos(component, self._adj, self._choices) for component in self._components]
+        fixed_arcs = list(self.arcs)
+        for arcs in _iter_product(factories):
+            yield fixed_arcs + arcs
+
+    def sample(self, nsamples=1) -> list:
+        """Return a list of nsamples DAGs sampled independently and uniformly at random from the MEC
+        """
+        from causaldag import DAG
+        return [DAG(nodes=set(self.nodes), arcs=self.sample_arcs()) for _ in range(nsamples)]
 
 
 class PDAG:
@@ -43,6 +472,8 @@ class PDAG:
                 self._add_edge(*edge)
 
         self._known_arcs = known_arcs.copy()
+        self._meek_counts = None
+        self._sampler = None
 
     @classmethod
     def from_df(cls, df, source_axis=0):
@@ -92,6 +523,48 @@ class PDAG:
 
         return PDAG(set(range(nrows)), arcs, edges)
 
+    @classmethod
+    def from_dag_amat(cls, amat, node_list=None):
+        """Return the essential graph of the DAG with adjacency matrix amat, without building the DAG.
+
+        For a moral DAG this is just its skeleton. Otherwise the arcs in v-structures (see _vstructure_arcs_amat) are
+        oriented and the Meek rules are propagated outward from their endpoints only, which on sparse graphs is much
+        cheaper than the dense sweeps of meek_closure_amat. Every arc of the result is compelled, and marked as known.
+
+        Parameters
+        ----------
+        amat:
+            n x n matrix with amat[i, j] != 0 iff i->j. Dense NumPy array or scipy sparse matrix.
+        node_list:
+            the nodes of the rows and columns of amat, by default 0..n-1.
+        """
+        rows, cols, in_vstructure = _vstructure_arcs_amat(amat)
+        node_list = list(range(amat.shape[0])) if node_list is None else list(node_list)
+        named = [(node_list[i], node_list[j]) for i, j in zip(rows.tolist(), cols.tolist())]
+        if in_vstructure is None:
+            return PDAG(node_list, edges=named)
+
+        vstructure_arcs = {arc for arc, compelled in zip(named, in_vstructure.tolist()) if compelled}
+        pdag = PDAG(node_list, vstructure_arcs, [arc for arc in named if arc not in vstructure_arcs])
+        pdag._propagate(list(itr.chain.from_iterable(vstructure_arcs)))
+        pdag._known_arcs = set(pdag._arcs)
+        return pdag
+
+    @classmethod
+    def from_dag(cls, dag):
+        """Return the essential graph of dag, as dag.cpdag() but through cpdag_from_amat on a sparse adjacency matrix
+        """
+        from scipy.sparse import coo_matrix
+        try:
+            node_list = sorted(dag.nodes)
+        except TypeError:
+            # Labels that cannot be ordered, e.g. a mix of integers and strings
+            node_list = list(dag.nodes)
+        node2ix = {node: i for i, node in enumerate(node_list)}
+        arcs = np.array([(node2ix[i], node2ix[j]) for i, j in dag.arcs], dtype=np.int64).reshape(-1, 2)
+        amat = coo_matrix((np.ones(len(arcs), dtype=np.int32), (arcs[:, 0], arcs[:, 1])), shape=(len(node_list), len(node_list)))
+        return cls.from_dag_amat(amat, node_list)
+
     @classmethod
     def from_nx(cls, nx_graph):
         return PDAG(nodes=nx_graph.nodes, edges=nx_graph.edges)
@@ -333,32 +806,83 @@ class PDAG:
                     vstructs.add((p2, node))
         return vstructs
 
-    def _undirected_reachable(self, node, tmp, visited):
-        visited.add(node)
-        tmp.add(node)
-        for nbr in filter(lambda nbr: nbr not in visited, self._undirected_neighbors[node]):
-            tmp = self._undirected_reachable(nbr, tmp, visited)
-        return tmp
+    def chain_component_nodes(self):
+        """Return the chain components of this graph with at least two nodes, as lists of nodes.
 
-    def chain_components(self, rename=False):
-        """Return the chain components of this graph.
+        Uses union-find over the undirected edges (with path halving and union by size), so there is no recursion and
+        the whole computation is a single pass over the edges.
 
         Return
         ------
-        List[Set[node]]
-            Return the partition of nodes coming from the relation of reachability by undirected edges.
+        List[List[node]]
         """
-        node_queue = self._nodes.copy()
-        components = []
-        visited_nodes = set()
+        parent = dict()
+        size = dict()
+        for i, j in self._edges:
+            for node in (i, j):
+                if node not in parent:
+                    parent[node] = node
+                    size[node] = 1
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            while parent[j] != j:
+                parent[j] = parent[parent[j]]
+                j = parent[j]
+            if i != j:
+                if size[i] < size[j]:
+                    i, j = j, i
+                parent[j] = i
+                size[i] += size[j]
+
+        components = defaultdict(list)
+        for node in parent:
+            root = node
+            while parent[root] != root:
+                parent[root] = parent[parent[root]]
+                root = parent[root]
+            components[root].append(node)
+        return list(components.values())
+
+    def chain_components(self, rename=False, views=False):
+        """Return the chain components of this graph.
 
-        while node_queue:
-            node = node_queue.pop()
-            if node not in visited_nodes:
-                reachable = self._undirected_reachable(node, set(), visited_nodes)
-                if len(reachable) > 1: components.append(reachable)
+        The subgraphs of all components are built in one pass over the arcs and edges. With views=True, they are
+        returned as PDAGViews of this graph instead, which copy nothing until they are mutated.
 
-        return [self.induced_subgraph(c, rename=rename) for c in components]
+        Return
+        ------
+        List[PDAG]
+            Return the partition of nodes coming from the relation of reachability by undirected edges.
+        """
+        components = self.chain_component_nodes()
+        if views:
+            if rename:
+                raise ValueError('Views keep the node labels of the graph, so rename is not supported')
+            return [PDAGView(self, set(nodes)) for nodes in components]
+
+        node2component = {node: c for c, nodes in enumerate(components) for node in nodes}
+        component_arcs = [set() for _ in components]
+        component_edges = [set() for _ in components]
+        for i, j in self._arcs:
+            c = node2component.get(i)
+            if c is not None and node2component.get(j) == c:
+                component_arcs[c].add((i, j))
+        for i, j in self._edges:
+            component_edges[node2component[i]].add((i, j))
+
+        subgraphs = []
+        for nodes, arcs, edges in zip(components, component_arcs, component_edges):
+            if rename:
+                ixs = {node: ix for ix, node in enumerate(nodes)}
+                subgraphs.append(PDAG(
+                    nodes=set(range(len(nodes))),
+                    arcs={(ixs[i], ixs[j]) for i, j in arcs},
+                    edges={(ixs[i], ixs[j]) for i, j in edges}
+                ))
+            else:
+                subgraphs.append(PDAG(nodes=set(nodes), arcs=arcs, edges=edges))
+        return subgraphs
 
     def induced_subgraph(self, nodes, rename=False):
         if rename:
@@ -373,14 +897,124 @@ class PDAG:
         return PDAG(nodes=new_nodes, arcs=arcs, edges=edges)
 
     def interventional_cpdag(self, dag, intervened_nodes):
-        cut_edges = set()
-        for node in intervened_nodes:
-        #    cut_edges.update(dag.incident_arcs(node))
-            cut_edges.update([(i,j) for i,j in dag.incident_arcs(node) if len({i,j} & set(intervened_nodes)) == 1])
-        p = PDAG(self._nodes, self._arcs | cut_edges, self._edges - {frozenset({i, j}) for i, j in cut_edges})
-        p.to_complete_pdag()
+        """Return the interventional essential graph obtained by intervening on intervened_nodes of dag.
+
+        This PDAG is assumed to be closed under the Meek rules (e.g. an (interventional) essential graph of dag).
+        Use intervene to update the PDAG in place instead of building a copy.
+        """
+        p = PDAG(self._nodes, self._arcs, self._edges)
+        p.intervene(dag, intervened_nodes)
+        return p
+
+    def batch_interventional_cpdag(self, dag, interventions):
+        """Return the interventional essential graph obtained by all the intervention sets in interventions on dag,
+        with a single propagation of the Meek rules (see intervene_batch).
+        """
+        p = PDAG(self._nodes, self._arcs, self._edges)
+        p.intervene_batch(dag, interventions)
         return p
 
+    @staticmethod
+    def _cut_arcs(dag, intervened_nodes):
+        intervened_nodes = set(intervened_nodes)
+        cut_arcs = set()
+        for node in intervened_nodes:
+            cut_arcs.update([(i, j) for i, j in dag.incident_arcs(node) if len({i, j} & intervened_nodes) == 1])
+        return cut_arcs
+
+    def intervene(self, dag, intervened_nodes):
+        """Orient the edges cut by intervening on intervened_nodes of dag, in place.
+
+        Only edges around the newly cut arcs are re-examined, so the cost scales with the number of edges that end up
+        oriented rather than with the size of the graph. This PDAG is assumed to be closed under the Meek rules.
+
+        Return
+        ------
+        Set[arc]
+            The arcs that were oriented by this intervention, either directly or through the Meek rules.
+        """
+        return self._orient_and_propagate(self._cut_arcs(dag, intervened_nodes))
+
+    def intervene_batch(self, dag, interventions):
+        """Orient the edges cut by each of the intervention sets in interventions, in place.
+
+        The cut arcs of all sets are collected first and the Meek rules are propagated once from all of them. The
+        Meek closure only depends on which arcs are oriented, not on the order they were oriented in, so the result is
+        the same as calling intervene on every set in turn, for the cost of one propagation.
+
+        Return
+        ------
+        Set[arc]
+            The arcs that were oriented by the interventions, either directly or through the Meek rules.
+        """
+        cut_arcs = set()
+        for intervened_nodes in interventions:
+            cut_arcs |= self._cut_arcs(dag, intervened_nodes)
+        return self._orient_and_propagate(cut_arcs)
+
+    def _meek_rule(self, i, j):
+        """Return the configuration ('a', 'b' or 'd', as in to_complete_pdag) that forces the edge i--j to be oriented
+        as i->j, or None if there is none.
+        """
+        # check configuration (a) -- causal chain
+        nbrs_j = self._neighbors[j]
+        for k in self._parents[i]:
+            if k not in nbrs_j:
+                return 'a'
+
+        # check configuration (b) -- acyclicity
+        if not self._children[i].isdisjoint(self._parents[j]):
+            return 'b'
+
+        # check configuration (d)
+        for k1, k2 in itr.combinations(self._parents[j] & self._undirected_neighbors[i], 2):
+            if k2 not in self._neighbors[k1]:
+                return 'd'
+        return None
+
+    def _orient_and_propagate(self, arcs):
+        """Orient the undirected edges in arcs and propagate the Meek rules outward from their endpoints.
+
+        A newly oriented arc i->j can only enable a Meek rule on an undirected edge incident to i or j, so a worklist
+        of endpoints is enough to reach the same fixpoint as to_complete_pdag.
+        """
+        oriented = set()
+        worklist = []
+        for i, j in arcs:
+            if j in self._undirected_neighbors[i]:
+                self._replace_edge_with_arc((i, j))
+                oriented.add((i, j))
+                worklist.append(i)
+                worklist.append(j)
+        return oriented | self._propagate(worklist)
+
+    def _propagate(self, worklist):
+        """Propagate the Meek rules outward from the nodes in worklist, which is consumed, and return the arcs oriented
+        """
+        oriented = set()
+        while worklist:
+            node = worklist.pop()
+            for nbr in list(self._undirected_neighbors[node]):
+                if nbr not in self._undirected_neighbors[node]:
+                    continue
+                for arc in ((node, nbr), (nbr, node)):
+                    rule = self._meek_rule(*arc)
+                    if rule is not None:
+                        self._replace_edge_with_arc(arc)
+                        oriented.add(arc)
+                        worklist.append(node)
+                        worklist.append(nbr)
+                        if self._meek_counts is not None:
+                            self._meek_counts[rule] += 1
+                        break
+        return oriented
+
+    def trace_meek_rules(self, counts):
+        """Count the Meek rule firings of intervene into counts, a mapping from configuration ('a', 'b' or 'd') to count
+        such as a collections.Counter. Pass None to stop counting; counting is off by default and not inherited by copies.
+        """
+        self._meek_counts = counts
+
     # === MUTATORS
     def _add_arc(self, i, j):
         self._nodes.add(i)
@@ -639,6 +1273,29 @@ class PDAG:
                     undecided_arcs.remove((arc[1], arc[0]))
                     self._replace_edge_with_arc(arc)
 
+    def to_complete_pdag_amat(self):
+        """
+        Same as to_complete_pdag, but runs the Meek rules as batched matrix operations (see meek_closure_amat).
+        Graphs with more than AMAT_MAX_NODES nodes, on which the dense matrices cost more than they save, are closed by
+        the set-based propagation instead.
+        """
+        if len(self._nodes) > AMAT_MAX_NODES:
+            self._propagate(list(self._nodes))
+            return
+        node_list = sorted(self._nodes)
+        node2ix = {node: i for i, node in enumerate(node_list)}
+        directed = np.zeros((len(node_list), len(node_list)), dtype=bool)
+        undirected = np.zeros((len(node_list), len(node_list)), dtype=bool)
+        for i, j in self._arcs:
+            directed[node2ix[i], node2ix[j]] = True
+        for i, j in self._edges:
+            undirected[node2ix[i], node2ix[j]] = True
+            undirected[node2ix[j], node2ix[i]] = True
+
+        directed_closed, _ = meek_closure_amat(directed, undirected)
+        for i, j in zip(*np.nonzero(directed_closed & ~directed)):
+            self._replace_edge_with_arc((node_list[i], node_list[j]))
+
     def remove_unprotected_orientations(self, verbose=False):
         """
         Replace with edges those arcs whose orientations cannot be determined by either:
@@ -733,103 +1390,80 @@ class PDAG:
         """
         from causaldag import DAG
 
-        pdag2 = self.copy()
+        # Repeatedly remove a sink without new v-structures; removals shrink a view of the graph instead of a copy
+        remaining = set(self._nodes)
+        view = PDAGView(self, remaining)
+        num_adjacencies = self.num_adjacencies
         arcs = set()
-        while len(pdag2._edges) + len(pdag2._arcs) != 0:
-            is_sink = lambda n: len(pdag2._children[n]) == 0
+        while num_adjacencies != 0:
+            is_sink = lambda n: len(view.children_of(n)) == 0
             no_vstructs = lambda n: all(
-                (pdag2._neighbors[n] - {u_nbr}).issubset(pdag2._neighbors[u_nbr])
-                for u_nbr in pdag2._undirected_neighbors[n]
+                (view.neighbors_of(n) - {u_nbr}).issubset(view.neighbors_of(u_nbr))
+                for u_nbr in view.undirected_neighbors_of(n)
             )
-            sink = next((n for n in pdag2._nodes if is_sink(n) and no_vstructs(n)), None)
+            sink = next((n for n in remaining if is_sink(n) and no_vstructs(n)), None)
             if sink is None:
                 break
-            arcs.update((nbr, sink) for nbr in pdag2._neighbors[sink])
-            pdag2.remove_node(sink)
+            nbrs = view.neighbors_of(sink)
+            arcs.update((nbr, sink) for nbr in nbrs)
+            num_adjacencies -= len(nbrs)
+            remaining.remove(sink)
 
         return DAG(arcs=arcs)
 
     # === MEC
     def mec_size(self):
         """Return the number of DAGs in the MEC represented by this PDAG
-        """
-        if self.num_arcs > 0:
-            return len(self.all_dags())
 
-        if self.num_edges == self.nnodes:
-            return 2*self.nnodes
-        elif self.num_edges == self.nnodes - 1:
-            return self.nnodes
-        elif self.num_edges == self.nnodes * (self.nnodes - 1) / 2:
-            return factorial(self.nnodes)
-        else:
-            return len(self.all_dags())
+        This PDAG is assumed to be closed under the Meek rules (e.g. a CPDAG or an interventional CPDAG), so that its
+        chain components are chordal and can be oriented independently of each other. The size is then the product of
+        the numbers of acyclic moral orientations of the chain components, each counted in polynomial time by
+        Clique-Picking; subproblems shared between cliques are only counted once.
+        """
+        memo = dict()
+        size = 1
+        for component in self.chain_component_nodes():
+            size *= _count_amos(component, self._undirected_neighbors, memo)
+        return size
+
+    def _get_sampler(self, save_sampler):
+        sampler = self._sampler
+        if sampler is None or not sampler.represents(self):
+            sampler = MecSampler(self)
+            self._sampler = sampler if save_sampler else None
+        return sampler
 
     def exact_sample(self, save_sampler=True, nsamples=1):
-        """Return a DAG sampled uniformly at random from the MEC represented by this PDAG
+        """Return a DAG sampled uniformly at random from the MEC represented by this PDAG, or a list of nsamples
+        independent samples if nsamples > 1.
+
+        Sampling uses a MecSampler, whose construction costs about as much as mec_size; with save_sampler=True it is
+        kept, and later calls reuse it as long as this PDAG has not changed. Uses the random module, so samples are
+        reproducible with random.seed.
         """
-        raise NotImplementedError
+        dags = self._get_sampler(save_sampler).sample(nsamples)
+        return dags[0] if nsamples == 1 else dags
 
-    def all_dags(self, verbose=False):
-        """Return all DAGs consistent with this PDAG
-        """
-        dag = self.to_dag()
-        arcs = dag._arcs
-        all_arcs = set()
-
-        orig_reversible_arcs = dag.reversible_arcs() - self._arcs
-        orig_parents_dict = dag.parents
-        orig_children_dict = dag.children
-
-        level = 0
-        q = [SmallDag(arcs, orig_reversible_arcs, orig_parents_dict, orig_children_dict, level)]
-        while q:
-            dag = q.pop()
-            all_arcs.add(frozenset(dag.arcs))
-            for i, j in dag.reversible_arcs:
-                new_arcs = frozenset({arc for arc in dag.arcs if arc != (i, j)} | {(j, i)})
-                if new_arcs not in all_arcs:
-                    new_parents_dict = {}
-                    new_children_dict = {}
-                    for node in dag.parents_dict.keys():
-                        parents = set(dag.parents_dict[node])
-                        children = set(dag.children_dict[node])
-                        if node == i:
-                            new_parents_dict[node] = parents | {j}
-                            new_children_dict[node] = children - {j}
-                        elif node == j:
-                            new_parents_dict[node] = parents - {i}
-                            new_children_dict[node] = children | {i}
-                        else:
-                            new_parents_dict[node] = parents
-                            new_children_dict[node] = children
+    def iter_dag_arcs(self, save_sampler=True):
+        """Yield every DAG in the MEC represented by this PDAG exactly once, as an integer array of shape
+        (num_adjacencies, 2) of its arcs if all nodes are integers, and as a list of arcs otherwise.
 
-                    new_reversible_arcs = dag.reversible_arcs.copy()
-                    for k in dag.parents_dict[j]:
-                        if (new_parents_dict[j] - {k}) == new_parents_dict[k] and (k, j) not in self._arcs:
-                            new_reversible_arcs.add((k, j))
-                        else:
-                            new_reversible_arcs.discard((k, j))
-                    for k in dag.children_dict[j]:
-                        if new_parents_dict[j] == (new_parents_dict[k] - {j}) and (j, k) not in self._arcs:
-                            new_reversible_arcs.add((j, k))
-                        else:
-                            new_reversible_arcs.discard((j, k))
-                    for k in dag.parents_dict[i]:
-                        if (new_parents_dict[i] - {k}) == new_parents_dict[k] and (k, i) not in self._arcs:
-                            new_reversible_arcs.add((k, i))
-                        else:
-                            new_reversible_arcs.discard((k, i))
-                    for k in dag.children_dict[i]:
-                        if new_parents_dict[i] == (new_parents_dict[k] - {i}) and (i, k) not in self._arcs:
-                            new_reversible_arcs.add((i, k))
-                        else:
-                            new_reversible_arcs.discard((i, k))
-
-                    q.append(
-                        SmallDag(new_arcs, new_reversible_arcs, new_parents_dict, new_children_dict, dag.level + 1))
+        DAGs are built lazily from the Clique-Picking partition of the class (see MecSampler), one chain component at a
+        time, so there is no store of visited DAGs: beyond the polynomial-size tables of the sampler, only the arcs of
+        the current DAG are kept.
+        """
+        sampler = self._get_sampler(save_sampler)
+        if all(isinstance(node, (int, np.integer)) and not isinstance(node, bool) for node in self._nodes):
+            for arcs in sampler.iter_arcs():
+                yield np.array(arcs, dtype=np.int64).reshape(-1, 2)
+        else:
+            yield from sampler.iter_arcs()
 
-        return all_arcs
+    def all_dags(self, verbose=False):
+        """Return all DAGs consistent with this PDAG, as a set of frozensets of arcs. See iter_dag_arcs to go through
+        them without holding all of them in memory.
+        """
+        return {frozenset(arcs) for arcs in self._get_sampler(True).iter_arcs()}
 
     def is_edge_clique(self, s):
         """
@@ -862,6 +1496,120 @@ class PDAG:
         return len(self.skeleton.symmetric_difference(other.skeleton))
 
 
+class PDAGView:
+    """Lazy view of the subgraph of a PDAG induced by a subset of its nodes.
+
+    Creating a view copies nothing: reads go to the parent's adjacency sets, filtered by the node subset, so looking
+    up a node's neighborhood costs O(its degree in the parent). The node set is not copied either, so removing nodes
+    from it shrinks the view. Until it is materialized, the view also reflects later changes to the parent.
+
+    Copy-on-write: the first call of anything outside the read API below (e.g. a mutator such as intervene or
+    to_complete_pdag) materializes the view into a standalone PDAG, and from then on the view behaves like that copy.
+    Private attributes of PDAG (such as _arcs) are not forwarded. Copying or pickling a view also copies its parent.
+    """
+    def __init__(self, pdag, nodes):
+        self._parent = pdag
+        self._view_nodes = nodes if isinstance(nodes, (set, frozenset)) else set(nodes)
+        self._materialized = None
+
+    def materialize(self) -> PDAG:
+        """Return the standalone PDAG backing this view, building it on the first call
+        """
+        if self._materialized is None:
+            self._materialized = PDAG(nodes=self._view_nodes, arcs=self.arcs, edges=self.edges)
+        return self._materialized
+
+    def copy(self) -> PDAG:
+        return self.materialize().copy() if self._materialized is not None else PDAG(nodes=self._view_nodes, arcs=self.arcs, edges=self.edges)
+
+    def __getattr__(self, name):
+        # Only called for attributes outside the read API. Private attributes are not forwarded, and neither is anything
+        # before __init__ has run: copy and pickle look up hooks such as __setstate__ on a view whose __dict__ is empty
+        if name.startswith('_') or '_parent' not in self.__dict__:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        return getattr(self.materialize(), name)
+
+    # === PROPERTIES
+    @property
+    def nodes(self):
+        if self._materialized is not None:
+            return self._materialized.nodes
+        return set(self._view_nodes)
+
+    @property
+    def nnodes(self):
+        if self._materialized is not None:
+            return self._materialized.nnodes
+        return len(self._view_nodes)
+
+    @property
+    def arcs(self):
+        if self._materialized is not None:
+            return self._materialized.arcs
+        nodes = self._view_nodes
+        return {(i, j) for i in nodes for j in self._parent._children[i] if j in nodes}
+
+    @property
+    def edges(self):
+        if self._materialized is not None:
+            return self._materialized.edges
+        nodes = self._view_nodes
+        return {frozenset({i, j}) for i in nodes for j in self._parent._undirected_neighbors[i] if j in nodes}
+
+    @property
+    def num_arcs(self):
+        if self._materialized is not None:
+            return self._materialized.num_arcs
+        nodes = self._view_nodes
+        return sum(1 for i in nodes for j in self._parent._children[i] if j in nodes)
+
+    @property
+    def num_edges(self):
+        if self._materialized is not None:
+            return self._materialized.num_edges
+        nodes = self._view_nodes
+        return sum(1 for i in nodes for j in self._parent._undirected_neighbors[i] if j in nodes) // 2
+
+    # === PROPERTIES W/ ARGUMENTS
+    def parents_of(self, node):
+        if self._materialized is not None:
+            return self._materialized.parents_of(node)
+        return self._parent._parents[node] & self._view_nodes
+
+    def children_of(self, node):
+        if self._materialized is not None:
+            return self._materialized.children_of(node)
+        return self._parent._children[node] & self._view_nodes
+
+    def neighbors_of(self, node):
+        if self._materialized is not None:
+            return self._materialized.neighbors_of(node)
+        return self._parent._neighbors[node] & self._view_nodes
+
+    def undirected_neighbors_of(self, node):
+        if self._materialized is not None:
+            return self._materialized.undirected_neighbors_of(node)
+        return self._parent._undirected_neighbors[node] & self._view_nodes
+
+    def undirected_degree_of(self, node):
+        return len(self.undirected_neighbors_of(node))
+
+    def has_edge(self, i, j):
+        if self._materialized is not None:
+            return self._materialized.has_edge(i, j)
+        return i in self._view_nodes and j in self._view_nodes and self._parent.has_edge(i, j)
+
+    def has_arc(self, i, j):
+        if self._materialized is not None:
+            return self._materialized.has_arc(i, j)
+        return i in self._view_nodes and j in self._view_nodes and self._parent.has_arc(i, j)
+
+    def has_edge_or_arc(self, i, j):
+        if self._materialized is not None:
+            return self._materialized.has_edge_or_arc(i, j)
+        return i in self._view_nodes and j in self._view_nodes and self._parent.has_edge_or_arc(i, j)
+
+
 if __name__ == '__main__':
     from causaldag.rand import directed_erdos
 
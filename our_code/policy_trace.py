@@ -0,0 +1,67 @@
+"""
+Opt-in structured trace of a separator_policy run, for finding out where the time goes on large graphs
+"""
+
+import sys
+import json
+from time import perf_counter
+from collections import Counter
+
+
+class PolicyTrace:
+    """
+    Pass an instance as separator_policy(..., trace=PolicyTrace()) to record
+
+    rounds: one dict per call of compute_separator_interventions, with its wall time, the number and sizes of the
+        chain components, the separator size of each component, the number of interventions queued, and the change in
+        the number of allocated memory blocks
+    interventions: one dict per intervention, with its size, the wall time of PDAG.intervene, the number of arcs
+        oriented directly by the cut and by the Meek rules, the Meek rule firings by configuration, and the change in
+        the number of allocated memory blocks
+    meek_counts: total Meek rule firings by configuration ('a', 'b', 'd', as in PDAG.to_complete_pdag)
+    skipped: number of queued interventions skipped because all their incident edges were already oriented
+
+    When no trace is passed, the only overhead is one None check per round and per intervention.
+    """
+    def __init__(self):
+        self.rounds = []
+        self.interventions = []
+        self.meek_counts = Counter()
+        self.skipped = 0
+
+    @staticmethod
+    def start():
+        """Return a (time, allocated blocks) mark to pass to the add_* methods
+        """
+        return perf_counter(), sys.getallocatedblocks()
+
+    def add_round(self, mark, **record):
+        self.rounds.append(dict(record, time=perf_counter() - mark[0], allocated_blocks=sys.getallocatedblocks() - mark[1]))
+
+    def add_intervention(self, mark, **record):
+        self.interventions.append(dict(record, time=perf_counter() - mark[0], allocated_blocks=sys.getallocatedblocks() - mark[1]))
+
+    def summary(self) -> dict:
+        return dict(
+            num_rounds=len(self.rounds),
+            num_interventions=len(self.interventions),
+            separator_time=sum(r['time'] for r in self.rounds),
+            intervene_time=sum(r['time'] for r in self.interventions),
+            max_components=max((r['num_components'] for r in self.rounds), default=0),
+            cut_arcs=sum(r['cut_arcs'] for r in self.interventions),
+            meek_arcs=sum(r['meek_arcs'] for r in self.interventions),
+            meek_counts=dict(self.meek_counts),
+            skipped=self.skipped,
+        )
+
+    def to_dict(self) -> dict:
+        return dict(
+            rounds=self.rounds,
+            interventions=self.interventions,
+            meek_counts=dict(self.meek_counts),
+            skipped=self.skipped
+        )
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
@@ -1,49 +1,91 @@
 import itertools as itr
 from dag_loader import DagLoader
-from alg_runner import AlgRunner
+from alg_runner import scheduled_imap, setting_tasks
+from results_store import ResultsStore
 import pandas as pd
-import math
+import numpy as np
+from tqdm import tqdm
 
 class ResultGetter:
-    def __init__(self, algs, nnodes_list, sampler, other_params_list, ngraphs=100, comparable_edges=True):
+    def __init__(self, algs, nnodes_list, sampler, other_params_list, ngraphs=100, comparable_edges=True, cost_sigma=None):
         self.algs = algs
         self.nnodes_list = nnodes_list
         self.other_params_list = other_params_list
         self.sampler = sampler
         self.ngraphs = ngraphs
+        self.cost_sigma = cost_sigma
         self.dag_loaders = [
-            DagLoader(nnodes, self.ngraphs, self.sampler, other_params, comparable_edges=comparable_edges)
+            DagLoader(nnodes, self.ngraphs, self.sampler, other_params, comparable_edges=comparable_edges, cost_sigma=cost_sigma)
             for nnodes, other_params in itr.product(self.nnodes_list, self.other_params_list)
         ]
 
-    def get_results(self, overwrite=False):
-        results = []
-
-        for alg in self.algs:
+    def run_missing(self, overwrite=False, multithread=True, use_cache=True, store=None):
+        """
+        Compute all missing (dag, policy) units in a single pass over the DAGs; with overwrite, the DAGs are regenerated,
+        all previous results of these settings are discarded first and no policy outcome is read from the cache.
+        Every DAG is read once, and all its missing policies and its verification number are computed by the same
+        worker. Tasks of all settings are scheduled together, so the cores stay busy until the whole sweep is done, and
+        DAGs that have to be generated are evaluated as soon as they are written (see alg_runner.scheduled_imap).
+        The rows of every DAG are checkpointed to the store as soon as it is done, so an interrupted sweep resumes from
+        the store's manifest of completed units.
+        """
+        store = ResultsStore() if store is None else store
+        if overwrite:
             for dl in self.dag_loaders:
-                ar = AlgRunner(alg, dl)
-                nnodes_list, times_list = ar.get_alg_results(overwrite=overwrite)
-                vo_list = dl.get_verification_optimal_ivs(overwrite=overwrite)
-
-                # For k > 1, use LOWER BOUND v_k(G) >= ceil(v_1(G) / k) for ratio computation
-                # For k = 1, v_k(G) = ceil(v_1(G) / k)
-                if 'separator' in alg:
-                    k = int(alg[-1])
-                    vo_list = [math.ceil(v1/k) for v1 in vo_list]
-
-                for nnodes, time, vo in zip(nnodes_list, times_list, vo_list):
-                    results.append(dict(
-                        alg=alg,
-                        nnodes=dl.nnodes,
-                        **dl.other_params,
-                        interventions=nnodes,
-                        time=time,
-                        vo=vo
-                    ))
-
-        res_df = pd.DataFrame(results)
-        res_df = res_df.set_index(list(set(res_df.columns) - {'interventions', 'time', 'vo'}))
-        res_df['regret_ratio'] = res_df['interventions'] / res_df['vo']
-        return res_df
+                store.delete(**dl.setting)
+        done = store.completed(sampler=self.sampler.name, alg=self.algs, num_dags=self.ngraphs, nnodes=self.nnodes_list)
+
+        settings = []
+        num_tasks = 0
+        for dl in self.dag_loaders:
+            setting = dl.setting
+            key = (setting['sampler'], setting['params'], setting['nnodes'], setting['num_dags'])
+            missing = lambda ix, key=key: [alg for alg in self.algs if (*key, ix, alg) not in done]
+            setting_num_tasks = sum(1 for ix in range(dl.num_dags) if missing(ix))
+            if setting_num_tasks > 0:
+                settings.append((setting, missing, dl))
+                num_tasks += setting_num_tasks
+
+        if not settings:
+            return
+
+        # DAGs of all settings are scheduled together, and those being generated are run as soon as they are written
+        task_settings = []
+        def items():
+            for setting, missing, dl in settings:
+                for item in setting_tasks(dl, missing, overwrite=overwrite, use_cache=use_cache):
+                    task_settings.append(setting)
+                    yield item
 
+        print(f'[ResultGetter.run_missing] Running {num_tasks} DAGs')
+        if multithread:
+            results_iter = scheduled_imap(items())
+        else:
+            # Generate all DAGs first, as the policies would otherwise draw from the random state that samples them
+            results_iter = ((i, function(*task)) for i, (_, function, task) in enumerate(list(items())))
+        for i, dag_rows in tqdm(results_iter, total=num_tasks):
+            store.append([dict(row, **task_settings[i]) for row in dag_rows])
+        store.compact()
 
+    def get_results(self, overwrite=False, multithread=True, use_cache=True, store=None):
+        store = ResultsStore() if store is None else store
+        self.run_missing(overwrite=overwrite, multithread=multithread, use_cache=use_cache, store=store)
+
+        params2other_params = {dl.setting['params']: dl.other_params for dl in self.dag_loaders}
+        res_df = store.read(
+            columns=['alg', 'params', 'nnodes', 'dag_ix', 'k', 'interventions', 'time', 'nu1', 'rounds', 'meek_arcs', 'cost', 'nu1_cost'],
+            sampler=self.sampler.name, params=list(params2other_params), nnodes=self.nnodes_list, num_dags=self.ngraphs, alg=self.algs
+        )
+
+        # For k > 1, use LOWER BOUND v_k(G) >= ceil(v_1(G) / k) for ratio computation
+        # For k = 1, v_k(G) = ceil(v_1(G) / k)
+        k = res_df['k'].fillna(1)
+        res_df['vo'] = np.ceil(res_df['nu1'] / k)
+        other_params = pd.DataFrame([params2other_params[params] for params in res_df['params']], index=res_df.index)
+        res_df = pd.concat([res_df.drop(columns=['params', 'k', 'nu1']), other_params], axis=1)
+        res_df = res_df.set_index(list(set(res_df.columns) - {'interventions', 'time', 'vo', 'rounds', 'meek_arcs', 'cost', 'nu1_cost'}))
+        res_df['regret_ratio'] = res_df['interventions'] / res_df['vo']
+
+        # With intervention costs, the cost of a minimum-cost atomic verifying set plays the role of nu1
+        res_df['cost_ratio'] = res_df['cost'] / res_df['nu1_cost']
+        return res_df
@@ -0,0 +1,140 @@
+"""
+Columnar store for experiment results, with one row per (sampler, params, nnodes, dag index, policy)
+"""
+
+import os
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from config import RESULTS_FOLDER
+
+SCHEMA = pa.schema([
+    ('sampler', pa.string()),
+    ('params', pa.string()),
+    ('nnodes', pa.int64()),
+    ('num_dags', pa.int64()),
+    ('dag_ix', pa.int64()),
+    ('alg', pa.string()),
+    ('k', pa.int64()),
+    ('interventions', pa.int64()),
+    ('time', pa.float64()),
+    ('nu1', pa.int64()),
+    ('rounds', pa.int64()),
+    ('meek_arcs', pa.int64()),
+    ('cost', pa.float64()),
+    ('nu1_cost', pa.float64()),
+    ('written_at', pa.float64()),
+])
+KEY_COLUMNS = ['sampler', 'params', 'nnodes', 'num_dags', 'dag_ix', 'alg']
+
+
+class ResultsStore:
+    """
+    Append-only folder of Parquet part files sharing SCHEMA.
+
+    Every append writes a new part file atomically (write to a hidden temporary file, then rename), so concurrent
+    writers never see each other's partial files. Rerunning a (setting, dag, policy) unit appends a new row rather than
+    rewriting old parts; reads keep only the most recently written row of every unit. compact() merges the part files
+    and drops the superseded rows. Appending the rows of every DAG as soon as it is done therefore checkpoints a sweep,
+    and the keys present in the store form the manifest of completed (dag, policy) units to resume from.
+    Optional columns (k, nu1, rounds, meek_arcs, and cost and nu1_cost in settings with intervention costs) are null
+    when they do not apply to a policy.
+    """
+    def __init__(self, folder=RESULTS_FOLDER):
+        self.folder = folder
+
+    def _part_filenames(self):
+        if not os.path.exists(self.folder):
+            return []
+        return sorted(
+            os.path.join(self.folder, f) for f in os.listdir(self.folder)
+            if f.endswith('.parquet') and not f.startswith('.')
+        )
+
+    def append(self, rows):
+        """Write rows (a list of dicts with the columns of SCHEMA, missing optional columns allowed) as a new part file
+        """
+        if len(rows) == 0:
+            return
+        written_at = time.time()
+        table = pa.Table.from_pylist(
+            [{**row, 'written_at': written_at} for row in rows],
+            schema=SCHEMA
+        )
+        os.makedirs(self.folder, exist_ok=True)
+        name = f'part-{time.time_ns()}-{os.getpid()}.parquet'
+        tmp_filename = os.path.join(self.folder, f'.{name}.tmp')
+        pq.write_table(table, tmp_filename)
+        os.replace(tmp_filename, os.path.join(self.folder, name))
+
+    def _filter(self, conditions):
+        expression = None
+        for column, value in conditions.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set, frozenset)):
+                term = ds.field(column).isin(list(value))
+            else:
+                term = ds.field(column) == value
+            expression = term if expression is None else expression & term
+        return expression
+
+    def read(self, columns=None, **conditions) -> pd.DataFrame:
+        """
+        Return the rows matching all conditions as a DataFrame. Each condition is column=value or column=list of values.
+        Conditions are pushed down to the Parquet reader, so only matching row groups are decoded.
+        """
+        filenames = self._part_filenames()
+        if len(filenames) == 0:
+            return SCHEMA.empty_table().to_pandas()[columns or SCHEMA.names]
+
+        read_columns = None if columns is None else list(dict.fromkeys(columns + KEY_COLUMNS + ['written_at']))
+        table = ds.dataset(filenames, schema=SCHEMA, format='parquet').to_table(
+            columns=read_columns,
+            filter=self._filter(conditions)
+        )
+        df = table.to_pandas()
+        df = df.sort_values('written_at', kind='stable').drop_duplicates(KEY_COLUMNS, keep='last')
+        df = df.sort_values(KEY_COLUMNS).reset_index(drop=True)
+        return df if columns is None else df[columns]
+
+    def completed(self, **conditions) -> set:
+        """Return the manifest of completed units matching all conditions, as a set of tuples of KEY_COLUMNS
+        """
+        df = self.read(columns=KEY_COLUMNS, **conditions)
+        return set(df.itertuples(index=False, name=None))
+
+    def delete(self, **conditions):
+        """Remove all rows matching all conditions, rewriting (atomically) only the part files that contain some
+        """
+        expression = self._filter(conditions)
+        for filename in self._part_filenames():
+            dataset = ds.dataset(filename, schema=SCHEMA, format='parquet')
+            if dataset.count_rows(filter=expression) == 0:
+                continue
+            table = dataset.to_table(filter=~expression)
+            if table.num_rows == 0:
+                os.remove(filename)
+            else:
+                tmp_filename = os.path.join(self.folder, f'.{os.path.basename(filename)}.tmp')
+                pq.write_table(table, tmp_filename)
+                os.replace(tmp_filename, filename)
+
+    def compact(self):
+        """Merge all part files into one, dropping rows that have been superseded by a later write
+        """
+        filenames = self._part_filenames()
+        if len(filenames) <= 1:
+            return
+        df = self.read()
+        name = f'part-{time.time_ns()}-{os.getpid()}.parquet'
+        tmp_filename = os.path.join(self.folder, f'.{name}.tmp')
+        pq.write_table(pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False), tmp_filename)
+        os.replace(tmp_filename, os.path.join(self.folder, name))
+        for filename in filenames:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass  # compacted concurrently
@@ -1,12 +1,13 @@
-from causaldag import DAG
+from causaldag import DAG, PDAG
 import random
-import networkx as nx
 
 from collections import defaultdict
 import math
-import sys
-sys.path.insert(0, './PADS')
-import LexBFS
+import os
+import numpy as np
+
+# Rounds whose chain components have fewer nodes in total than this are not worth shipping to an executor
+PARALLEL_MIN_NODES = 1000
 
 '''
 Verify that the peo computed is valid
@@ -28,41 +29,118 @@ def verify_peo(adj_list, actual_to_peo, peo_to_actual):
         assert False
 
 '''
-Compute perfect elimination ordering using PADS
-Source: https://www.ics.uci.edu/~eppstein/PADS/ABOUT-PADS.txt
+Compute perfect elimination ordering via maximum cardinality search [TY84] in O(n+m) time
+Repeatedly visit an unvisited node with the most visited neighbors; the reverse of the visit order is a peo of a chordal graph
+Nodes are bucketed by their number of visited neighbors so that the next node to visit is found in amortized O(1) time
 '''
 def peo(adj_list, nodes):
     n = len(nodes)
 
-    G = dict()
-    for v in nodes:
-        G[v] = adj_list[v]
-    lexbfs_output = list(LexBFS.LexBFS(G))
+    weight = [0] * n
+    visited = [False] * n
+    buckets = [set() for _ in range(n+1)]
+    buckets[0].update(nodes)
+    max_weight = 0
+    output = []
+    for _ in range(n):
+        while len(buckets[max_weight]) == 0:
+            max_weight -= 1
+        v = buckets[max_weight].pop()
+        visited[v] = True
+        output.append(v)
+        for u in adj_list[v]:
+            if not visited[u]:
+                buckets[weight[u]].remove(u)
+                weight[u] += 1
+                buckets[weight[u]].add(u)
+        max_weight += 1
 
     # Reverse computed ordering to get actual perfect elimination ordering
-    output = lexbfs_output[::-1]
-    
-    actual_to_peo = dict()
-    peo_to_actual = dict()
+    output = output[::-1]
+
+    peo_to_actual = output
+    actual_to_peo = [0] * n
     for i in range(n):
-        peo_to_actual[i] = output[i]
         actual_to_peo[output[i]] = i
 
-    # Sanity check: verify PADS's peo output
+    # Sanity check: verify peo output
     # Can comment out for computational speedup
     #verify_peo(adj_list, actual_to_peo, peo_to_actual)
-    
+
     return actual_to_peo, peo_to_actual
 
+'''
+Compute the connected components of size >= 2 of the undirected part of a PDAG, i.e. its chain components
+Each component is returned as (nodes, adj_list) where node i of the component is nodes[i] in the PDAG and adj_list[i] lists the neighbors of i
+'''
+def undirected_components(pdag):
+    undirected_neighbors = pdag._undirected_neighbors
+    components = []
+    for cc_nodes in pdag.chain_component_nodes():
+        # Map indices of component into 0..n-1
+        map_indices = {v: i for i, v in enumerate(cc_nodes)}
+        adj_list = [[map_indices[u] for u in undirected_neighbors[v]] for v in cc_nodes]
+        components.append((cc_nodes, adj_list))
+    return components
+
+'''
+Return the number of nodes of the largest connected component of the graph minus the nodes marked in removed, by BFS
+'''
+def largest_component_size(adj_list, removed):
+    seen = list(removed)
+    largest = 0
+    for s in range(len(adj_list)):
+        if seen[s]:
+            continue
+        seen[s] = True
+        queue = [s]
+        for v in queue:
+            for u in adj_list[v]:
+                if not seen[u]:
+                    seen[u] = True
+                    queue.append(u)
+        largest = max(largest, len(queue))
+    return largest
+
+'''
+Given a connected chordal graph and a peo of it, return the maximal cliques whose removal leaves no connected component with more than half of the nodes
+The maximal cliques are read off the peo: node v gives the clique C_v = {v} plus its later neighbors, which is not maximal iff C_v = C_u minus u for some u whose elimination tree parent (lowest later neighbor) is v
+A chordal graph has at most n maximal cliques, and the largest component left by each is found by BFS, in O(n(n+m)) time overall
+'''
+def balanced_clique_separators(adj_list, actual_to_peo, peo_to_actual):
+    n = len(peo_to_actual)
+    later = [[u for u in adj_list[v] if actual_to_peo[u] > actual_to_peo[v]] for v in range(n)]
+    maximal = [True] * n
+    for v in range(n):
+        if later[v]:
+            parent = min(later[v], key=actual_to_peo.__getitem__)
+            if len(later[v]) == len(later[parent]) + 1:
+                maximal[parent] = False
+
+    separators = []
+    removed = [False] * n
+    for v in peo_to_actual:
+        if not maximal[v]:
+            continue
+        clique = [v] + later[v]
+        for u in clique:
+            removed[u] = True
+        if largest_component_size(adj_list, removed) <= n/2:
+            separators.append(clique)
+        for u in clique:
+            removed[u] = False
+    return separators
+
 '''
 Given a connected chordal graph on n nodes, compute the 1/2-clique graph separator
 FAST CHORDAL SEPARATOR algorithm of [GRE84]
 Reference: [GRE84] A Separator Theorem for Chordal Graphs
+If positive node costs cost[v] are given, return instead the cheapest of this separator and the balanced maximal cliques of balanced_clique_separators (ties go to the [GRE84] separator)
 '''
-def compute_clique_graph_separator(adj_list, nodes):
+def compute_clique_graph_separator(adj_list, nodes, cost=None):
     n = len(nodes)
 
-    # Compute perfect elimination ordering via lex bfs
+    # Compute perfect elimination ordering via maximum cardinality search
     actual_to_peo, peo_to_actual = peo(adj_list, nodes)
 
     w = [1] * n
@@ -87,11 +165,67 @@ def compute_clique_graph_separator(adj_list, nodes):
     for j in adj_list[peo_to_actual[peo_i]]:
         if actual_to_peo[j] > peo_i:
             C.append(j)
+
+    if cost is not None:
+        C_cost = sum(cost[v] for v in C)
+        for clique in balanced_clique_separators(adj_list, actual_to_peo, peo_to_actual):
+            clique_cost = sum(cost[v] for v in clique)
+            if clique_cost < C_cost:
+                C, C_cost = clique, clique_cost
     return C
 
 '''
-Maintain a queue of (bounded) size interventions, skipping interventions if all incident edges already oriented.
-If queue is empty, gather 1/2-clique separators from each connected component of size >= 2, and attempt to orient them.
+Pack the adjacency lists of several components into one CSR structure: the number of nodes of each component, and for every node (component after component) the offset of its neighbors in one flat int32 array.
+Three arrays pickle much faster than nested lists when they are sent to a worker process.
+'''
+def pack_components(adj_lists):
+    sizes = np.array([len(adj_list) for adj_list in adj_lists], dtype=np.int64)
+    offsets = np.zeros(sizes.sum() + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(nbrs) for adj_list in adj_lists for nbrs in adj_list])
+    neighbors = np.fromiter((u for adj_list in adj_lists for nbrs in adj_list for u in nbrs), dtype=np.int32, count=offsets[-1])
+    return sizes, offsets, neighbors
+
+'''
+Compute the 1/2-clique separator of each component packed by pack_components, with the costs of all nodes (component after component) in one flat array if given
+'''
+def packed_component_separators(sizes, offsets, neighbors, costs=None):
+    separators = []
+    start = 0
+    for size in sizes:
+        adj_list = [neighbors[offsets[start + v]:offsets[start + v + 1]].tolist() for v in range(size)]
+        cost = None if costs is None else costs[start:start + size].tolist()
+        separators.append(compute_clique_graph_separator(adj_list, list(range(size)), cost))
+        start += size
+    return separators
+
+'''
+Compute the 1/2-clique separator of each component on a concurrent.futures executor and return them in the order of adj_lists (costs[ix] lists the node costs of component ix, if given).
+Components are split into num_chunks batches of roughly equal total size (largest component first, each to the currently lightest batch), so that one task per batch keeps the workers evenly loaded.
+'''
+def parallel_component_separators(adj_lists, executor, num_chunks, costs=None):
+    chunks = [[] for _ in range(min(num_chunks, len(adj_lists)))]
+    loads = [0] * len(chunks)
+    for ix in sorted(range(len(adj_lists)), key=lambda ix: -len(adj_lists[ix])):
+        lightest = loads.index(min(loads))
+        chunks[lightest].append(ix)
+        loads[lightest] += len(adj_lists[ix]) + sum(len(nbrs) for nbrs in adj_lists[ix])
+
+    futures = [
+        executor.submit(
+            packed_component_separators,
+            *pack_components([adj_lists[ix] for ix in chunk]),
+            None if costs is None else np.array([c for ix in chunk for c in costs[ix]], dtype=np.float64)
+        )
+        for chunk in chunks
+    ]
+    separators = [None] * len(adj_lists)
+    for chunk, future in zip(chunks, futures):
+        for ix, separator in zip(chunk, future.result()):
+            separators[ix] = separator
+    return separators
+
+'''
+Gather 1/2-clique separators from each connected component of size >= 2 of the undirected part of cpdag, and return a list of (bounded) size interventions that orients them.
 To orient the union of 1/2-clique separator nodes Q, use atomic interventions if k = 1 or |Q| = 1, else compute the labelling scheme of Lemma 1 of [SKDV15].
 
 The following few lines are copied from the proof of Lemma 1
@@ -99,106 +233,202 @@ Let n = p_d a^d + r_d and n = p_{d-1} a^{d-1} + r_{d-1}
 1) Repeat 0 a^{d-1} times, repeat the next integer 1 a^{d-1} times and so on circularly from {0,1,...,a-1} till p_d * a^d.
 2) After that, repeat 0 ceil(r_d/a) times followed by 1 ceil(r_d/a) times till we reach the nth position. Clearly, n-th integer in the sequence would not exceed a-1.
 3) Every integer occurring after the position a^{d-1} p_{d-1} is increased by 1.
+
+If a concurrent.futures executor is given (e.g. a ProcessPoolExecutor), the separators of the components are computed on it in num_chunks batches (default: one per CPU).
+The result does not depend on whether an executor is used.
+If positive node costs are given (costs[v] for every node v), the separator of each component is the cheapest balanced clique separator instead (see compute_clique_graph_separator).
+'''
+def compute_separator_interventions(cpdag, k: int, trace=None, executor=None, num_chunks=None, costs=None) -> list:
+    mark = trace.start() if trace is not None else None
+
+    # Compute 1/2-clique separator for each connected component of size >= 2
+    components = undirected_components(cpdag)
+    component_costs = [None] * len(components) if costs is None else [[costs[v] for v in cc_nodes] for cc_nodes, _ in components]
+    if executor is not None and len(components) > 1 and sum(len(cc_nodes) for cc_nodes, _ in components) >= PARALLEL_MIN_NODES:
+        separators = parallel_component_separators(
+            [adj_list for _, adj_list in components], executor, num_chunks or os.cpu_count(), None if costs is None else component_costs
+        )
+    else:
+        separators = [
+            compute_clique_graph_separator(adj_list, list(range(len(cc_nodes))), cost)
+            for (cc_nodes, adj_list), cost in zip(components, component_costs)
+        ]
+
+    clique_separator_nodes = []
+    component_sizes = []
+    separator_sizes = []
+    for (cc_nodes, _), separator in zip(components, separators):
+        # Add the clique separator of this connected component to the list
+        clique_separator_nodes += [cc_nodes[v] for v in separator]
+        component_sizes.append(len(cc_nodes))
+        separator_sizes.append(len(separator))
+
+    assert len(clique_separator_nodes) > 0
+    if k == 1 or len(clique_separator_nodes) == 1:
+        intervention_queue = [set([v]) for v in clique_separator_nodes]
+    else:
+        # Setup parameters. Note that [SKDV15] use n and x+1 instead of h and L
+        h = len(clique_separator_nodes)
+        k_prime = min(k, h/2)
+        a = math.ceil(h/k_prime)
+        assert a >= 2
+        L = math.ceil(math.log(h,a))
+        assert pow(a,L-1) < h and h <= pow(a,L)
+
+        # Execute labelling scheme
+        S = defaultdict(set)
+        for d in range(1, L+1):
+            a_d = pow(a,d)
+            r_d = h % a_d
+            p_d = h // a_d
+            a_dminus1 = pow(a,d-1)
+            r_dminus1 = h % a_dminus1 # Unused
+            p_dminus1 = h // a_dminus1
+            assert h == p_d * a_d + r_d
+            assert h == p_dminus1 * a_dminus1 + r_dminus1
+            for i in range(1, h+1):
+                node = clique_separator_nodes[i-1]
+                if i <= p_d * a_d:
+                    val = (i % a_d) // a_dminus1
+                else:
+                    val = (i - p_d * a_d) // math.ceil(r_d / a)
+                if i > a_dminus1 * p_dminus1:
+                    val += 1
+                S[(d,val)].add(node)
+
+        # Store output
+        intervention_queue = list(S.values())
+    assert len(intervention_queue) > 0
+
+    if trace is not None:
+        trace.add_round(
+            mark,
+            num_components=len(component_sizes),
+            component_sizes=component_sizes,
+            separator_sizes=separator_sizes,
+            num_interventions=len(intervention_queue)
+        )
+    return intervention_queue
+
+'''
+Maintain a queue of (bounded) size interventions, skipping interventions if all incident edges already oriented.
+If queue is empty, refill it with compute_separator_interventions on the current CPDAG.
+
+Optionally, the essential graph cpdag of dag and the first round of interventions computed from it can be passed in, so that DAGs in the same MEC can share them.
+Neither is modified.
+If a dict stats is given, it is filled with the number of rounds (separator computations) and the number of arcs oriented by Meek propagation rather than directly by the interventions.
+If a PolicyTrace trace is given, per-round and per-intervention timings and counters are recorded into it.
+If a concurrent.futures executor is given, the separators of the chain components in each round are computed on it (see compute_separator_interventions); the Meek rule propagation after each intervention stays sequential.
+
+With batched=True, the policy is non-adaptive within a round: all the interventions of a round (the k-bounded sets of the labelling scheme over the separators of every component) are performed together as one batch, and the CPDAG is updated once per batch with a single Meek closure (PDAG.intervene_batch).
+No intervention of a batch is skipped, so this can use more interventions than the adaptive mode, in as many rounds as the adaptive mode computes separators at most.
+The number of rounds (batches) is reported in stats as in the adaptive mode.
+
+If positive per-node intervention costs are given (costs[v] for every node v, e.g. an array indexed by node for DAGs on 0..n-1), separators are chosen by cost (see compute_separator_interventions).
 '''
-def separator_policy(dag: DAG, k: int, verbose: bool = False) -> set:
+def separator_policy(dag: DAG, k: int, verbose: bool = False, cpdag=None, intervention_queue=None, stats=None, trace=None, executor=None, batched=False, costs=None) -> set:
     intervened_nodes = set()
+    rounds = 1 if intervention_queue else 0
+    meek_arcs = 0
 
-    current_cpdag = dag.cpdag()
+    current_cpdag = PDAG.from_dag(dag) if cpdag is None else cpdag.copy()
+    if trace is not None:
+        current_cpdag.trace_meek_rules(trace.meek_counts)
 
-    intervention_queue = []
-    while current_cpdag.num_arcs != dag.num_arcs:
+    intervention_queue = [] if intervention_queue is None else list(intervention_queue)
+    while batched and current_cpdag.num_arcs != dag.num_arcs:
         if verbose: print(f"Remaining edges: {current_cpdag.num_edges}")
-        
-        node_to_intervene = None
-        undirected_portions = current_cpdag.copy()
-        undirected_portions.remove_all_arcs()
 
-        # Cannot directly use G = undirected_portions.to_nx() because it does not first add the nodes
-        # We need to first add nodes because we want to check if the clique nodes have incident edges
-        # See https://causaldag.readthedocs.io/en/latest/_modules/causaldag/classes/pdag.html#PDAG 
-        G = nx.Graph()
-        G.add_nodes_from(undirected_portions.nodes)
-        G.add_edges_from(undirected_portions.edges)
+        if len(intervention_queue) == 0:
+            intervention_queue = compute_separator_interventions(current_cpdag, k, trace=trace, executor=executor, costs=costs)
+            rounds += 1
+        batch = [frozenset(intervention) for intervention in intervention_queue]
+        intervention_queue = []
+        assert all(len(intervention) <= k for intervention in batch)
+        intervened_nodes.update(batch)
 
+        # An arc is cut iff some intervention of the batch contains exactly one of its endpoints
+        node2batch = defaultdict(set)
+        for ix, intervention in enumerate(batch):
+            for node in intervention:
+                node2batch[node].add(ix)
+        mark = trace.start() if trace is not None else None
+        meek_counts = dict(trace.meek_counts) if trace is not None else None
+        oriented = current_cpdag.intervene_batch(dag, batch)
+        num_meek = sum(not (node2batch[i] ^ node2batch[j]) for i, j in oriented)
+        meek_arcs += num_meek
+        if trace is not None:
+            trace.add_intervention(
+                mark,
+                size=sum(len(intervention) for intervention in batch),
+                batch_size=len(batch),
+                cut_arcs=len(oriented) - num_meek,
+                meek_arcs=num_meek,
+                meek_firings={rule: count - meek_counts.get(rule, 0) for rule, count in trace.meek_counts.items()}
+            )
+
+    while current_cpdag.num_arcs != dag.num_arcs:
+        if verbose: print(f"Remaining edges: {current_cpdag.num_edges}")
+        
         intervention = None
         while len(intervention_queue) > 0 and intervention is None:
             intervention = intervention_queue.pop()
     
             # If all incident edges already oriented, skip this intervention
-            if sum([G.degree[node] for node in intervention]) == 0:
+            if sum([current_cpdag.undirected_degree_of(node) for node in intervention]) == 0:
                 intervention = None
+                if trace is not None:
+                    trace.skipped += 1
 
         if intervention is None:
             assert len(intervention_queue) == 0
-
-            # Compute 1/2-clique separator for each connected component of size >= 2
-            clique_separator_nodes = []
-            for cc_nodes in nx.connected_components(G):
-                if len(cc_nodes) == 1:
-                    continue
-                cc = G.subgraph(cc_nodes)
-                
-                # Map indices of subgraph into 0..n-1
-                n = len(cc.nodes())
-                map_indices = dict()
-                unmap_indices = dict()
-                for v in cc.nodes():
-                    map_indices[v] = len(map_indices)
-                    unmap_indices[map_indices[v]] = v
-
-                # Extract adj_list and nodes of subgraph
-                nodes = []
-                adj_list = []
-                for v, nbr_dict in cc.adjacency():
-                    nodes.append(map_indices[v])
-                    adj_list.append([map_indices[x] for x in list(nbr_dict.keys())])
-
-                # Compute clique separator for this connected component then add to the list
-                clique_separator_nodes += [unmap_indices[v] for v in compute_clique_graph_separator(adj_list, nodes)]
-
-            assert len(clique_separator_nodes) > 0
-            if k == 1 or len(clique_separator_nodes) == 1:
-                intervention_queue = [set([v]) for v in clique_separator_nodes]
-            else:
-                # Setup parameters. Note that [SKDV15] use n and x+1 instead of h and L
-                h = len(clique_separator_nodes)
-                k_prime = min(k, h/2)
-                a = math.ceil(h/k_prime)
-                assert a >= 2
-                L = math.ceil(math.log(h,a))
-                assert pow(a,L-1) < h and h <= pow(a,L)
-
-                # Execute labelling scheme
-                S = defaultdict(set)
-                for d in range(1, L+1):
-                    a_d = pow(a,d)
-                    r_d = h % a_d
-                    p_d = h // a_d
-                    a_dminus1 = pow(a,d-1)
-                    r_dminus1 = h % a_dminus1 # Unused
-                    p_dminus1 = h // a_dminus1
-                    assert h == p_d * a_d + r_d
-                    assert h == p_dminus1 * a_dminus1 + r_dminus1
-                    for i in range(1, h+1):
-                        node = clique_separator_nodes[i-1]
-                        if i <= p_d * a_d:
-                            val = (i % a_d) // a_dminus1
-                        else:
-                            val = (i - p_d * a_d) // math.ceil(r_d / a)
-                        if i > a_dminus1 * p_dminus1:
-                            val += 1
-                        S[(d,val)].add(node)
-
-                # Store output
-                intervention_queue = list(S.values())
-            assert len(intervention_queue) > 0    
+            intervention_queue = compute_separator_interventions(current_cpdag, k, trace=trace, executor=executor, costs=costs)
             intervention = intervention_queue.pop()
+            rounds += 1
 
         # Intervene on selected node(s) and update the CPDAG
         assert intervention is not None
         assert len(intervention) <= k
         intervention = frozenset(intervention)
         intervened_nodes.add(intervention)
-        current_cpdag = current_cpdag.interventional_cpdag(dag, intervention)
+        if trace is None:
+            oriented = current_cpdag.intervene(dag, intervention)
+            meek_arcs += sum(len({i, j} & intervention) != 1 for i, j in oriented)
+        else:
+            mark = trace.start()
+            meek_counts = dict(trace.meek_counts)
+            oriented = current_cpdag.intervene(dag, intervention)
+            num_meek = sum(len({i, j} & intervention) != 1 for i, j in oriented)
+            meek_arcs += num_meek
+            trace.add_intervention(
+                mark,
+                size=len(intervention),
+                cut_arcs=len(oriented) - num_meek,
+                meek_arcs=num_meek,
+                meek_firings={rule: count - meek_counts.get(rule, 0) for rule, count in trace.meek_counts.items()}
+            )
 
+    if stats is not None:
+        stats['rounds'] = rounds
+        stats['meek_arcs'] = meek_arcs
     return intervened_nodes
+
+'''
+Run separator_policy on a batch of DAGs, given either as a list of DAGs or as a stacked (num_dags, n, n) adjacency tensor as stored by DagLoader.
+DAGs with the same skeleton and v-structures have the same essential graph, so each MEC in the batch computes its essential graph and first round of separator interventions only once.
+'''
+def separator_policy_batch(dags, k: int, verbose: bool = False) -> list:
+    if isinstance(dags, np.ndarray):
+        dags = [DAG.from_amat(amat) for amat in dags]
+
+    mec_cache = dict()
+    intervened_nodes_list = []
+    for dag in dags:
+        mec_key = (frozenset(frozenset(arc) for arc in dag.arcs), frozenset(dag.arcs_in_vstructures()))
+        if mec_key not in mec_cache:
+            cpdag = PDAG.from_dag(dag)
+            first_round = compute_separator_interventions(cpdag, k) if cpdag.num_edges > 0 else []
+            mec_cache[mec_key] = (cpdag, first_round)
+        cpdag, first_round = mec_cache[mec_key]
+        intervened_nodes_list.append(separator_policy(dag, k, verbose=verbose, cpdag=cpdag, intervention_queue=first_round))
+    return intervened_nodes_list
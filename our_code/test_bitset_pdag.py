@@ -0,0 +1,105 @@
+"""
+Differential checks of BitsetPDAG against PDAG on random DAGs: essential graphs, Meek closure, interventions and chain
+components must agree exactly
+
+Run with python3 -m pytest test_bitset_pdag.py
+"""
+
+import random
+import itertools as itr
+import pytest
+from causaldag import DAG, PDAG
+
+from bitset_pdag import BitsetPDAG
+
+
+'''
+Random DAG on nodes 0..nnodes-1 (relabelled by a random permutation). With moral=True, the parents of every node form a
+clique, so that the essential graph has many undirected edges; otherwise every pair is adjacent with probability density
+'''
+def random_dag(nnodes, density, rng, moral=False):
+    perm = list(range(nnodes))
+    rng.shuffle(perm)
+    if not moral:
+        arcs = {(i, j) for i, j in itr.combinations(range(nnodes), 2) if rng.random() < density}
+    else:
+        arcs = set()
+        parents = {0: set()}
+        for v in range(1, nnodes):
+            u = rng.randrange(v)
+            parents[v] = {u} | {w for w in parents[u] if rng.random() < .7}
+            arcs |= {(w, v) for w in parents[v]}
+    return DAG(nodes=set(range(nnodes)), arcs={(perm[i], perm[j]) for i, j in arcs})
+
+def random_dags(num_dags, seed):
+    rng = random.Random(seed)
+    for ix in range(num_dags):
+        yield random_dag(rng.randint(2, 30), rng.choice([.1, .3, .6]), rng, moral=ix % 2 == 1), rng
+
+'''
+Split the arcs of dag into those in a v-structure and the others
+'''
+def vstructure_arcs(dag):
+    compelled = set()
+    for j in dag.nodes:
+        for a, b in itr.combinations(dag.parents_of(j), 2):
+            if not dag.has_arc(a, b) and not dag.has_arc(b, a):
+                compelled |= {(a, j), (b, j)}
+    return compelled, set(dag.arcs) - compelled
+
+def assert_same_graph(bitset_pdag, pdag):
+    assert bitset_pdag.nodes == pdag.nodes
+    assert bitset_pdag.arcs == pdag.arcs
+    assert bitset_pdag.edges == {frozenset(edge) for edge in pdag.edges}
+    assert (bitset_pdag.num_arcs, bitset_pdag.num_edges) == (pdag.num_arcs, pdag.num_edges)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_to_complete_pdag(seed):
+    for dag, _ in random_dags(40, seed):
+        compelled, others = vstructure_arcs(dag)
+        bitset_pdag = BitsetPDAG(dag.nodes, compelled, others)
+        bitset_pdag.to_complete_pdag()
+        pdag = PDAG(dag.nodes, compelled, others)
+        pdag.to_complete_pdag()
+        assert_same_graph(bitset_pdag, pdag)
+        assert_same_graph(bitset_pdag, PDAG.from_dag(dag))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_intervene(seed):
+    for dag, rng in random_dags(40, seed):
+        pdag = PDAG.from_dag(dag)
+        bitset_pdag = BitsetPDAG.from_pdag(pdag)
+        assert_same_graph(bitset_pdag, pdag)
+        nodes = sorted(dag.nodes)
+        while pdag.num_edges > 0:
+            intervened_nodes = set(rng.sample(nodes, rng.randint(1, 2)))
+            assert bitset_pdag.intervene(dag, intervened_nodes) == pdag.intervene(dag, intervened_nodes)
+            assert_same_graph(bitset_pdag, pdag)
+            assert sorted(map(sorted, (component.nodes for component in bitset_pdag.chain_components()))) == sorted(map(sorted, pdag.chain_component_nodes()))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_intervene_batch(seed):
+    for dag, rng in random_dags(40, seed):
+        nodes = sorted(dag.nodes)
+        interventions = [set(rng.sample(nodes, rng.randint(1, 2))) for _ in range(rng.randint(1, 4))]
+        pdag = PDAG.from_dag(dag)
+        bitset_pdag = BitsetPDAG.from_pdag(pdag)
+        assert_same_graph(bitset_pdag.batch_interventional_cpdag(dag, interventions), pdag.batch_interventional_cpdag(dag, interventions))
+        assert bitset_pdag.intervene_batch(dag, interventions) == pdag.intervene_batch(dag, interventions)
+        assert_same_graph(bitset_pdag, pdag)
+
+
+def test_non_integer_labels():
+    rng = random.Random(3)
+    for _ in range(20):
+        dag = random_dag(rng.randint(2, 15), .4, rng, moral=True)
+        dag = DAG(nodes={f'v{node}' for node in dag.nodes}, arcs={(f'v{i}', f'v{j}') for i, j in dag.arcs})
+        pdag = PDAG.from_dag(dag)
+        bitset_pdag = BitsetPDAG.from_pdag(pdag)
+        intervened_nodes = {rng.choice(sorted(dag.nodes))}
+        assert bitset_pdag.intervene(dag, intervened_nodes) == pdag.intervene(dag, intervened_nodes)
+        assert_same_graph(bitset_pdag, pdag)
+        assert_same_graph(bitset_pdag.to_pdag(), pdag)
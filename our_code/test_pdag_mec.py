@@ -0,0 +1,115 @@
+"""
+Brute-force checks of the Clique-Picking MEC counting, sampling and enumeration of PDAG against exhaustive enumeration
+of the orientations of small PDAGs
+
+Run with python3 -m pytest test_pdag_mec.py
+"""
+
+import random
+import itertools as itr
+import networkx as nx
+import pytest
+from causaldag import DAG, PDAG
+
+
+'''
+Random DAG on nodes 0..nnodes-1 (relabelled by a random permutation) where every pair is adjacent with probability density
+'''
+def random_dag(nnodes, density, rng):
+    perm = list(range(nnodes))
+    rng.shuffle(perm)
+    return DAG(nodes=set(range(nnodes)), arcs={(perm[i], perm[j]) for i, j in itr.combinations(range(nnodes), 2) if rng.random() < density})
+
+'''
+Return the v-structures of a set of arcs as a set of (parent, child, parent) triples with parents in sorted order, where adjacent is the set of adjacent pairs (as frozensets) of the skeleton
+'''
+def vstructures(arcs, adjacent):
+    parents = dict()
+    for i, j in arcs:
+        parents.setdefault(j, set()).add(i)
+    return {
+        (*sorted((a, b), key=repr), j)
+        for j, pa in parents.items()
+        for a, b in itr.combinations(pa, 2)
+        if frozenset((a, b)) not in adjacent
+    }
+
+'''
+Return every DAG consistent with a PDAG that is closed under the Meek rules, as a set of frozensets of arcs, by trying all
+orientations of its undirected edges: a consistent DAG is acyclic, keeps the arcs of the PDAG and has no v-structure
+other than those of the PDAG
+'''
+def brute_force_mec(pdag):
+    edges = [tuple(edge) for edge in pdag.edges]
+    adjacent = {frozenset(arc) for arc in pdag.arcs} | {frozenset(edge) for edge in edges}
+    pdag_vstructures = vstructures(pdag.arcs, adjacent)
+    dags = set()
+    for flips in itr.product([False, True], repeat=len(edges)):
+        arcs = set(pdag.arcs) | {(j, i) if flip else (i, j) for (i, j), flip in zip(edges, flips)}
+        if nx.is_directed_acyclic_graph(nx.DiGraph(list(arcs))) and vstructures(arcs, adjacent) == pdag_vstructures:
+            dags.add(frozenset(arcs))
+    return dags
+
+'''
+Yield small essential and interventional essential graphs with at most max_edges undirected edges, with nodes relabelled by relabel if given
+'''
+def small_pdags(num_dags, seed, max_edges=12, relabel=None):
+    rng = random.Random(seed)
+    count = 0
+    while count < num_dags:
+        dag = random_dag(rng.randint(2, 8), rng.choice([.3, .5, .8]), rng)
+        if relabel is not None:
+            dag = DAG(nodes={relabel(node) for node in dag.nodes}, arcs={(relabel(i), relabel(j)) for i, j in dag.arcs})
+        pdag = PDAG.from_dag(dag)
+        if rng.random() < .3:
+            intervened = rng.sample(sorted(dag.nodes, key=repr), rng.randint(1, 2))
+            pdag = pdag.interventional_cpdag(dag, {intervened[0]} if len(intervened) == 1 else set(intervened))
+        if pdag.num_edges <= max_edges:
+            count += 1
+            yield pdag
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_mec_size(seed):
+    for pdag in small_pdags(50, seed):
+        assert pdag.mec_size() == len(brute_force_mec(pdag))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_all_dags(seed):
+    for pdag in small_pdags(50, seed):
+        expected = brute_force_mec(pdag)
+        assert pdag.all_dags() == expected
+        assert len(list(pdag.iter_dag_arcs())) == len(expected)
+
+
+# Tuple labels, and mixed integer and string labels
+RELABELINGS = [lambda node: (node, chr(ord('a') + node)), lambda node: node if node % 2 == 0 else f'x{node}']
+
+@pytest.mark.parametrize('relabel', RELABELINGS)
+def test_all_dags_non_integer_labels(relabel):
+    for pdag in small_pdags(50, 0, relabel=relabel):
+        expected = brute_force_mec(pdag)
+        assert pdag.mec_size() == len(expected)
+        assert pdag.all_dags() == expected
+        assert {frozenset(arcs) for arcs in pdag.iter_dag_arcs()} == expected
+
+
+def test_all_dags_tuple_path():
+    dag = DAG(arcs={((0, 'a'), (1, 'b')), ((1, 'b'), (2, 'c'))})
+    pdag = PDAG.from_dag(dag)
+    assert pdag.mec_size() == 3
+    assert pdag.all_dags() == brute_force_mec(pdag)
+    assert frozenset(dag.arcs) in pdag.all_dags()
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_exact_sample_support(seed):
+    random.seed(seed)
+    for pdag in small_pdags(30, seed, max_edges=8):
+        expected = brute_force_mec(pdag)
+        if len(expected) > 30:
+            continue
+        # With 20 samples per DAG, a DAG of the MEC is missed with probability about exp(-20)
+        samples = {frozenset(dag.arcs) for dag in pdag.exact_sample(nsamples=20 * len(expected))}
+        assert samples == expected
@@ -0,0 +1,60 @@
+"""
+Checks of PDAGView against the induced subgraphs of PDAG, and copy/pickle round trips of views
+
+Run with python3 -m pytest test_pdag_view.py
+"""
+
+import copy
+import pickle
+import random
+import itertools as itr
+import pytest
+from causaldag import DAG, PDAG
+from causaldag.classes.pdag import PDAGView
+
+
+'''
+Random essential graph on nodes 0..nnodes-1, with a random node subset of it
+'''
+def random_cpdag_and_nodes(rng):
+    nnodes = rng.randint(3, 12)
+    dag = DAG(nodes=set(range(nnodes)), arcs={(i, j) for i, j in itr.combinations(range(nnodes), 2) if rng.random() < .4})
+    return PDAG.from_dag(dag), set(rng.sample(range(nnodes), rng.randint(1, nnodes)))
+
+def assert_same_graph(view, pdag):
+    assert view.nodes == pdag.nodes
+    assert view.arcs == pdag.arcs
+    assert {frozenset(edge) for edge in view.edges} == {frozenset(edge) for edge in pdag.edges}
+
+
+def test_view_matches_induced_subgraph():
+    rng = random.Random(0)
+    for _ in range(50):
+        cpdag, nodes = random_cpdag_and_nodes(rng)
+        view = PDAGView(cpdag, nodes)
+        assert_same_graph(view, cpdag.induced_subgraph(nodes))
+        assert view.num_arcs == len(view.arcs) and view.num_edges == len(view.edges)
+
+
+@pytest.mark.parametrize('materialize', [False, True])
+@pytest.mark.parametrize('round_trip', [copy.copy, copy.deepcopy, lambda view: pickle.loads(pickle.dumps(view))])
+def test_view_round_trip(materialize, round_trip):
+    rng = random.Random(1)
+    for _ in range(20):
+        cpdag, nodes = random_cpdag_and_nodes(rng)
+        view = PDAGView(cpdag, nodes)
+        if materialize:
+            view.materialize()
+        copied = round_trip(view)
+        assert isinstance(copied, PDAGView)
+        assert_same_graph(copied, cpdag.induced_subgraph(nodes))
+        # Forwarded (materializing) calls still work on the copy
+        assert {frozenset(arcs) for arcs in copied.all_dags()} == cpdag.induced_subgraph(nodes).all_dags()
+
+
+def test_view_private_attributes_are_not_forwarded():
+    cpdag, nodes = random_cpdag_and_nodes(random.Random(2))
+    view = PDAGView(cpdag, nodes)
+    with pytest.raises(AttributeError):
+        view._arcs
+    assert view._materialized is None
@@ -0,0 +1,99 @@
+"""
+Brute-force checks of the clique separators of separator_policy against networkx on small random chordal graphs
+
+Run with python3 -m pytest test_separator_policy.py
+"""
+
+import random
+import networkx as nx
+import numpy as np
+import pytest
+from causaldag import DAG, PDAG
+
+from separator_policy import peo, balanced_clique_separators, compute_clique_graph_separator, separator_policy
+
+
+'''
+Random connected chordal graph on nodes 0..nnodes-1, as an adjacency list: every new node is joined to a random clique made of an earlier node and some of the nodes it was joined to
+'''
+def random_chordal_adj_list(nnodes, rng):
+    adj_list = [[] for _ in range(nnodes)]
+    parents = {0: []}
+    for v in range(1, nnodes):
+        u = rng.randrange(v)
+        parents[v] = [u] + [w for w in parents[u] if rng.random() < .7]
+        for w in parents[v]:
+            adj_list[v].append(w)
+            adj_list[w].append(v)
+    perm = list(range(nnodes))
+    rng.shuffle(perm)
+    shuffled = [None] * nnodes
+    for v in range(nnodes):
+        shuffled[perm[v]] = [perm[u] for u in adj_list[v]]
+    return shuffled
+
+def to_nx(adj_list):
+    G = nx.Graph()
+    G.add_nodes_from(range(len(adj_list)))
+    G.add_edges_from((v, u) for v in range(len(adj_list)) for u in adj_list[v])
+    return G
+
+'''
+Largest connected component of G minus the nodes of separator, and the balanced maximal cliques of G, by brute force
+'''
+def largest_component(G, separator):
+    H = G.subgraph(set(G) - set(separator))
+    return max((len(component) for component in nx.connected_components(H)), default=0)
+
+def brute_force_balanced_cliques(G):
+    return {frozenset(clique) for clique in nx.find_cliques(G) if largest_component(G, clique) <= len(G) / 2}
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_balanced_clique_separators(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        nnodes = rng.randint(8, 40)
+        adj_list = random_chordal_adj_list(nnodes, rng)
+        actual_to_peo, peo_to_actual = peo(adj_list, list(range(nnodes)))
+        separators = balanced_clique_separators(adj_list, actual_to_peo, peo_to_actual)
+        assert len(separators) == len({frozenset(clique) for clique in separators})
+        assert {frozenset(clique) for clique in separators} == brute_force_balanced_cliques(to_nx(adj_list))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_compute_clique_graph_separator_costs(seed):
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    for _ in range(100):
+        nnodes = rng.randint(8, 40)
+        adj_list = random_chordal_adj_list(nnodes, rng)
+        G = to_nx(adj_list)
+        cost = np_rng.lognormal(0, 1, nnodes).tolist()
+
+        separator = compute_clique_graph_separator(adj_list, list(range(nnodes)), cost)
+        unweighted = compute_clique_graph_separator(adj_list, list(range(nnodes)))
+        assert largest_component(G, separator) <= nnodes / 2
+        assert largest_component(G, unweighted) <= nnodes / 2
+
+        # The weighted separator is no more expensive than the [GRE84] one or than any balanced maximal clique
+        separator_cost = sum(cost[v] for v in separator)
+        assert separator_cost <= sum(cost[v] for v in unweighted) + 1e-9
+        assert all(separator_cost <= sum(cost[v] for v in clique) + 1e-9 for clique in brute_force_balanced_cliques(G))
+
+
+@pytest.mark.parametrize('k', [1, 2])
+def test_separator_policy_costs(k):
+    rng = random.Random(k)
+    for _ in range(20):
+        nnodes = rng.randint(8, 30)
+        adj_list = random_chordal_adj_list(nnodes, rng)
+        order = list(range(nnodes))
+        rng.shuffle(order)
+        rank = {v: i for i, v in enumerate(order)}
+        dag = DAG(nodes=set(range(nnodes)), arcs={(v, u) if rank[v] < rank[u] else (u, v) for v in range(nnodes) for u in adj_list[v]})
+        costs = np.random.default_rng(k).lognormal(0, 1, nnodes)
+
+        interventions = separator_policy(dag, k, costs=costs)
+        cpdag = PDAG.from_dag(dag).batch_interventional_cpdag(dag, [{intervention} if type(intervention) is not frozenset else intervention for intervention in interventions])
+        assert cpdag.num_edges == 0
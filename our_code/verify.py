@@ -2,6 +2,7 @@ import causaldag as cd
 import random
 import networkx as nx
 from networkx.algorithms import bipartite
+import numpy as np
 
 '''
 Given a directed graph G (networkx graph object), output the set of edges that are covered edges.
@@ -34,6 +35,110 @@ def compute_minimum_vertex_cover(H):
     assert is_vertex_cover(H, mvc)
     return mvc
 
+'''
+Same output as compute_covered_edges, without building a parent set per edge.
+Each node gets a random 64-bit key and each parent set is hashed to the XOR of the keys of its nodes, so u->v can only be covered if hash(Pa(v)) = hash(Pa(u)) XOR key(u) and |Pa(v)| = |Pa(u)| + 1.
+Only these candidates are compared exactly, so hash collisions cannot produce wrong answers.
+'''
+def compute_covered_edges_fast(G):
+    rng = random.Random(len(G))
+    key = {v: rng.getrandbits(64) for v in G.nodes}
+    parents_hash = dict()
+    for v in G.nodes:
+        h = 0
+        for u in G.predecessors(v):
+            h ^= key[u]
+        parents_hash[v] = h
+
+    covered_edges = set()
+    for u, v in G.edges:
+        if parents_hash[v] == parents_hash[u] ^ key[u] and G.in_degree(v) == G.in_degree(u) + 1:
+            if all(G.has_edge(w, v) for w in G.predecessors(u)):
+                covered_edges.add((u,v))
+    return covered_edges
+
+'''
+Given the edges of a forest H, output a minimum vertex cover in O(|H|) time by repeatedly stripping leaves.
+The edge at a leaf must be covered, and taking the leaf's neighbor instead of the leaf covers a superset of its edges.
+'''
+def compute_forest_minimum_vertex_cover(edges):
+    adj = dict()
+    for u,v in edges:
+        adj.setdefault(u, []).append(v)
+        adj.setdefault(v, []).append(u)
+    degree = {v: len(nbrs) for v, nbrs in adj.items()}
+
+    mvc = set()
+    removed = set()
+    leaves = [v for v in adj if degree[v] == 1]
+    while leaves:
+        v = leaves.pop()
+        if v in removed or degree[v] != 1:
+            continue
+        u = next(w for w in adj[v] if w not in removed)
+        mvc.add(u)
+        removed.add(v)
+        removed.add(u)
+        for w in adj[u]:
+            if w not in removed:
+                degree[w] -= 1
+                if degree[w] == 1:
+                    leaves.append(w)
+
+    if any(v not in removed and degree[v] > 0 for v in adj):
+        raise ValueError("Edges do not form a forest")
+    return mvc
+
+'''
+Given the edges of a forest H and positive vertex costs (cost[v] for every vertex v, e.g. a dict or an array indexed by node), output a minimum-weight vertex cover in O(|H|) time.
+Leaf stripping is only optimal for unit costs, so this is a dynamic program over every tree of the forest, children before parents:
+with[v] is the cheapest cover of the subtree of v that contains v, without[v] the cheapest one that does not, which must then contain all children of v.
+'''
+def compute_forest_minimum_weight_vertex_cover(edges, cost):
+    adj = dict()
+    for u,v in edges:
+        adj.setdefault(u, []).append(v)
+        adj.setdefault(v, []).append(u)
+
+    mvc = set()
+    visited = set()
+    for root in adj:
+        if root in visited:
+            continue
+        # Iterative DFS, so that the reverse of the visit order has every child before its parent
+        parent = {root: None}
+        order = []
+        stack = [root]
+        visited.add(root)
+        while stack:
+            v = stack.pop()
+            order.append(v)
+            for u in adj[v]:
+                if u != parent[v]:
+                    if u in visited:
+                        raise ValueError("Edges do not form a forest")
+                    visited.add(u)
+                    parent[u] = v
+                    stack.append(u)
+
+        with_v = dict()
+        without_v = dict()
+        for v in reversed(order):
+            children = [u for u in adj[v] if u != parent[v]]
+            with_v[v] = cost[v] + sum(min(with_v[u], without_v[u]) for u in children)
+            without_v[v] = sum(with_v[u] for u in children)
+
+        # Recover the choices top-down: a vertex is in the cover if its parent is not, or if that is cheaper
+        in_cover = dict()
+        for v in order:
+            if parent[v] is not None and not in_cover[parent[v]]:
+                in_cover[v] = True
+            else:
+                in_cover[v] = with_v[v] <= without_v[v]
+            if in_cover[v]:
+                mvc.add(v)
+    return mvc
+
 '''
 Given a graph G and a set vc of vertices, return whether vc is a vertex cover of G.
 '''
@@ -61,12 +166,43 @@ def atomic_verification(G):
 
     return mvc
 
+'''
+Same as atomic_verification, but with hashed covered edge detection and a linear-time vertex cover on the covered edge forest.
+Avoids all networkx matching calls, so that computing nu_1(G) on DAGs with 100k nodes is practical.
+'''
+def atomic_verification_fast(G):
+    return compute_forest_minimum_vertex_cover(compute_covered_edges_fast(G))
+
+'''
+Same as atomic_verification_fast, but minimizing the total cost of the intervened vertices instead of their number, for positive per-node costs cost[v].
+Any set of (possibly non-atomic) interventions that cuts every covered edge intervenes on a vertex cover of them, so the cost of the output lower-bounds the cost of every verifying intervention set when the cost of an intervention is the sum of the costs of its vertices.
+'''
+def weighted_atomic_verification(G, cost):
+    return compute_forest_minimum_weight_vertex_cover(compute_covered_edges_fast(G), cost)
+
+'''
+Compute atomic_verification for a batch of DAGs, given either as a list of networkx DiGraphs or as a stacked (num_dags, n, n) adjacency tensor as stored by DagLoader.
+Identical DAGs in the batch are only verified once.
+'''
+def atomic_verification_batch(Gs):
+    if isinstance(Gs, np.ndarray):
+        Gs = [nx.from_numpy_array(amat, create_using=nx.DiGraph) for amat in Gs]
+
+    cache = dict()
+    mvcs = []
+    for G in Gs:
+        key = frozenset(G.edges)
+        if key not in cache:
+            cache[key] = atomic_verification_fast(G)
+        mvcs.append(cache[key])
+    return mvcs
+
 '''
 Given graph G and subset of vertices I, determine whether I is an atomic intervention set that fully orients essential graph of G.
 '''
 def validate(G, I):
     dag = cd.DAG.from_nx(G)
-    cpdag = dag.interventional_cpdag([{node} for node in I], cpdag=dag.cpdag())
+    cpdag = cd.PDAG.from_dag(dag).batch_interventional_cpdag(dag, [{node} for node in I])
     assert cpdag.num_edges == 0
     print("Validated that {0} fully orients essential graph".format(I))
 
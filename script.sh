@@ -6,7 +6,7 @@ cd dct-policy
 # Note: Given setup script has some missing pip installs
 bash setup.sh
 source venv/bin/activate
-pip install seaborn tqdm ipdb p_tqdm
+pip install seaborn tqdm ipdb p_tqdm pyarrow
 pip install networkx==2.8.8
 
 # Grab PADS source files